@@ -1,15 +1,128 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.core.urlresolvers import reverse
+from django.db import connections
+from django.http import QueryDict, StreamingHttpResponse
+from django.utils.html import format_html
+import json
+
+from combinedchoices.cloning import clone_baseccos, clone_ready
+from combinedchoices.exports import iter_chunked, iter_records
 from combinedchoices.models import (
     BaseCCO, ChoiceSection, Choice, CompletedCCO, ReadyCCO, Section)
+from combinedchoices.routers import shard_dbs
+
+
+ESTIMATE_QUERIES = {
+    'postgresql': 'SELECT reltuples FROM pg_class WHERE relname = %s',
+    'mysql': (
+        'SELECT table_rows FROM information_schema.tables '
+        'WHERE table_schema = DATABASE() AND table_name = %s'),
+}
+
+
+def estimated_count(queryset):
+    """
+    Returns the planner's row estimate for an unfiltered table, or None
+    when the backend has none or the estimate is small enough to count.
+    """
+    if queryset.query.where:
+        return None
+    sql = ESTIMATE_QUERIES.get(connections[queryset.db].vendor)
+    if sql is None:
+        return None
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    threshold = getattr(
+        settings, 'COMBINEDCHOICES_ADMIN_COUNT_THRESHOLD', 10000)
+    if row is None or row[0] is None or row[0] < threshold:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = estimated_count(self.object_list)
+        if self._count is None:
+            self._count = self.object_list.count()
+        return self._count
+
+
+def inline_limit():
+    return getattr(settings, 'COMBINEDCHOICES_ADMIN_INLINE_LIMIT', 100)
+
+
+def copy_name(name):
+    return ('%s (copy)' % name)[:64]
+
+
+def stream_export(modeladmin, request, queryset):
+    lines = (
+        json.dumps(record, sort_keys=True) + '\n'
+        for record in iter_records(queryset.defer(None)))
+    response = StreamingHttpResponse(
+        lines, content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename=completed.jsonl'
+    return response
+stream_export.short_description = 'Export selected as JSON lines'
+
+
+def clone_selected_baseccos(modeladmin, request, queryset):
+    count = 0
+    chunk = []
+    for basecco in iter_chunked(queryset.select_related('user')):
+        chunk.append(basecco)
+        if len(chunk) == 500:
+            count += clone_basecco_chunk(chunk)
+            chunk = []
+    count += clone_basecco_chunk(chunk)
+    modeladmin.message_user(request, 'Cloned %s forms.' % count)
+clone_selected_baseccos.short_description = 'Clone selected forms'
+
+
+def clone_basecco_chunk(baseccos):
+    by_user = {}
+    for basecco in baseccos:
+        by_user.setdefault(basecco.user_id, []).append(basecco)
+    for group in by_user.values():
+        clone_baseccos(group, group[0].user, form_names=dict(
+            (basecco.id, copy_name(basecco.form_name)) for basecco in group))
+    return len(baseccos)
+
+
+def clone_selected_readies(modeladmin, request, queryset):
+    count = 0
+    for ready in iter_chunked(queryset.select_related('user')):
+        clone_ready(ready, ready.user, form_name=copy_name(ready.form_name))
+        count += 1
+    modeladmin.message_user(request, 'Cloned %s ready forms.' % count)
+clone_selected_readies.short_description = 'Clone selected ready forms'
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    raw_id_fields = ('user',)
+    list_select_related = ('user',)
 
 
 class ChoiceSectionThroughInline(admin.TabularInline):
     model = BaseCCO.sections.through
+    raw_id_fields = ('section',)
 
 
-class BaseCCObjAdmin(admin.ModelAdmin):
+class BaseCCObjAdmin(ScalableAdmin):
     model = BaseCCO
     inlines = (ChoiceSectionThroughInline,)
+    list_display = ['form_name', 'user']
+    search_fields = ['form_name']
+    actions = [clone_selected_baseccos]
 
 
 class ChoiceAdmin(admin.TabularInline):
@@ -20,10 +133,132 @@ class ChoiceSectionAdmin(admin.ModelAdmin):
     model = ChoiceSection
     inlines = [ChoiceAdmin,]
     list_display =['basecco', 'section']
+    list_select_related = ('basecco__user', 'section__user')
+    raw_id_fields = ('basecco', 'section')
+    readonly_fields = ('choice_list',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def choice_count(self, obj):
+        if not hasattr(obj, '_choice_count'):
+            obj._choice_count = obj.choice_set.count()
+        return obj._choice_count
+
+    def get_inline_instances(self, request, obj=None):
+        # Large sections are edited from the paginated Choice changelist.
+        if obj is not None and self.choice_count(obj) > inline_limit():
+            return []
+        return super(ChoiceSectionAdmin, self).get_inline_instances(
+            request, obj)
+
+    def choice_list(self, obj):
+        if obj is None or obj.pk is None:
+            return ''
+        return format_html(
+            '<a href="{0}?choice_section__id__exact={1}">{2} choices</a>',
+            reverse('admin:combinedchoices_choice_changelist'), obj.pk,
+            self.choice_count(obj))
+    choice_list.short_description = 'Choices'
+
+
+class ChoiceModelAdmin(admin.ModelAdmin):
+    model = Choice
+    list_display = ['__str__', 'choice_section']
+    list_select_related = (
+        'choice_section__basecco__user', 'choice_section__section__user')
+    raw_id_fields = ('choice_section',)
+    search_fields = ['text']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+def request_shard(request):
+    # The change and delete views carry the changelist filters along.
+    shard = request.GET.get(ShardListFilter.parameter_name)
+    if shard is None:
+        shard = QueryDict(request.GET.get('_changelist_filters', '')).get(
+            ShardListFilter.parameter_name)
+    shards = shard_dbs()
+    if shard not in shards:
+        return shards[0] if shards else None
+    return shard
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    # Completions of every shard, one shard per page.
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(shard, shard) for shard in shard_dbs()]
+
+    def choices(self, changelist):
+        current = self.value() or shard_dbs()[0]
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': current == lookup,
+                'query_string': changelist.get_query_string(
+                    {self.parameter_name: lookup}, []),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # CompletedCCOAdmin.get_queryset already picked the shard.
+        return queryset
+
+
+class CompletedCCOChangeList(ChangeList):
+
+    def get_queryset(self, request):
+        # The list never shows form_data, so it is not even fetched.
+        return super(CompletedCCOChangeList, self).get_queryset(
+            request).defer('form_data')
+
+    def apply_select_related(self, queryset):
+        # Users and ReadyCCOs are not on the shards to join against.
+        if shard_dbs():
+            return queryset
+        return super(CompletedCCOChangeList, self).apply_select_related(
+            queryset)
+
+
+class CompletedCCOAdmin(ScalableAdmin):
+    list_display = ['form_name', 'user', 'ready', 'created']
+    list_select_related = ('user', 'ready')
+    raw_id_fields = ('user', 'ready', 'snapshot')
+    actions = [stream_export]
+
+    def get_list_filter(self, request):
+        if shard_dbs():
+            return [ShardListFilter] + list(self.list_filter)
+        return self.list_filter
+
+    def get_queryset(self, request):
+        queryset = super(CompletedCCOAdmin, self).get_queryset(request)
+        shard = request_shard(request)
+        if shard is not None:
+            queryset = queryset.using(shard)
+        return queryset
+
+    def get_changelist(self, request, **kwargs):
+        return CompletedCCOChangeList
+
+
+class ReadyCCOAdmin(ScalableAdmin):
+    list_display = ['form_name', 'user']
+    raw_id_fields = ('user', 'included_forms')
+    search_fields = ['form_name']
+    actions = [clone_selected_readies]
+
+
+class SectionAdmin(ScalableAdmin):
+    list_display = ['field_name', 'field_type', 'user']
+    search_fields = ['field_name']
 
 
 admin.site.register(BaseCCO, BaseCCObjAdmin)
 admin.site.register(ChoiceSection, ChoiceSectionAdmin)
-admin.site.register(CompletedCCO)
-admin.site.register(ReadyCCO)
-admin.site.register(Section)
+admin.site.register(Choice, ChoiceModelAdmin)
+admin.site.register(CompletedCCO, CompletedCCOAdmin)
+admin.site.register(ReadyCCO, ReadyCCOAdmin)
+admin.site.register(Section, SectionAdmin)
@@ -0,0 +1,69 @@
+"""
+Coroutines for ASGI views. Django's ORM is synchronous, so queries run
+on a thread pool and the event loop only waits on them; the three loader
+queries of an uncached schema run concurrently. Requires Python 3.5+.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+import asyncio
+import functools
+
+from combinedchoices.forms import ReadyForm
+from combinedchoices.models import ReadyCCO
+from combinedchoices.schema import get_cache, schema_key, set_schema
+
+
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=getattr(
+            settings, 'COMBINEDCHOICES_ASYNC_WORKERS', 4))
+    return executor
+
+
+def in_thread(func, *args, **kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(
+        get_executor(), functools.partial(in_thread, func, *args, **kwargs))
+
+
+async def aget_ready(**kwargs):
+    return await run_sync(ReadyCCO.objects.get_or_404, **kwargs)
+
+
+async def aload_schema(ready_obj, form_class=ReadyForm):
+    key = await run_sync(schema_key, ready_obj, form_class.__name__)
+    schema = await run_sync(get_cache().get, key)
+    if schema is None:
+        results = await asyncio.gather(*[
+            run_sync(list, queryset)
+            for queryset in form_class.schema_loader(ready_obj).queries()])
+        schema = await run_sync(
+            form_class.compile_schema, ready_obj, results)
+        await run_sync(set_schema, key, schema)
+    return schema
+
+
+async def aready_form(ready_obj, *args, **kwargs):
+    """
+    Builds form_class (default ReadyForm) for ready_obj without blocking
+    the event loop. Binding and validation happen in memory.
+    """
+    form_class = kwargs.pop('form_class', ReadyForm)
+    kwargs['schema'] = await aload_schema(ready_obj, form_class)
+    return form_class(*args, ready_obj=ready_obj, **kwargs)
+
+
+async def asave(form, *args, **kwargs):
+    return await run_sync(form.save, *args, **kwargs)
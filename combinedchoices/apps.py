@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class CombinedChoicesConfig(AppConfig):
+    name = 'combinedchoices'
+    verbose_name = 'Combined Choices'
+
+    def ready(self):
+        import combinedchoices.signals
+        from combinedchoices.instrumentation import register_from_settings
+        register_from_settings()
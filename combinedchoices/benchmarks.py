@@ -0,0 +1,99 @@
+from collections import OrderedDict
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from combinedchoices.forms import ReadyForm
+from combinedchoices.models import (
+    BaseCCO, Choice, ChoiceSection, ReadyCCO, Section)
+from combinedchoices.schema import bump_definitions_version
+
+
+PHASES = ('build', 'build_cached', 'render', 'validate', 'save')
+
+
+def make_dataset(users=1, baseccos=5, sections_per_type=2,
+                 choices_per_section=5, prefix='bench'):
+    readies = []
+    for user_count in range(users):
+        user = User.objects.create(username='%s%s' % (prefix, user_count))
+        sections = []
+        for field_type, type_name in Section.CHOICE_TYPES:
+            for count in range(sections_per_type):
+                sections.append(Section.objects.create(
+                    user=user, field_type=field_type,
+                    field_name='%s %s' % (type_name, count),
+                    cross_combine=bool(count % 2)))
+        forms = []
+        for count in range(baseccos):
+            basecco = BaseCCO.objects.create(
+                user=user, form_name='form %s' % count)
+            forms.append(basecco)
+            choices = []
+            for section in sections:
+                choice_section = ChoiceSection.objects.create(
+                    basecco=basecco, section=section)
+                choices.extend(
+                    Choice(choice_section=choice_section,
+                           text='%s %s choice %s' % (
+                               basecco.form_name, section.field_name, text))
+                    for text in range(choices_per_section))
+            Choice.objects.bulk_create(choices)
+        ready = ReadyCCO.objects.create(user=user, form_name='ready')
+        ready.included_forms.add(*forms)
+        readies.append(ready)
+    bump_definitions_version()
+    return readies
+
+
+def post_data(form):
+    data = {'form_name': 'benchmark'}
+    for entry in form.schema:
+        name = entry['name']
+        if entry['field_type'] == Section.SINGLE and entry['choices']:
+            data[name] = entry['choices'][0][0]
+        elif entry['field_type'] == Section.MULTIPLE:
+            data[name] = [pk for pk, text in entry['choices']]
+        elif entry['field_type'] == Section.NUMBER:
+            for count in range(len(entry['choices'])):
+                data['%s_%s' % (name, count)] = entry['initial']
+        elif entry['initial']:
+            data[name] = entry['initial']
+    return data
+
+
+def measure(func):
+    if tracemalloc is not None:
+        tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.time()
+        value = func()
+        seconds = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return value, {
+        'queries': len(queries), 'seconds': seconds, 'peak_memory': peak}
+
+
+def run_benchmark(ready_obj, form_class=ReadyForm):
+    results = OrderedDict()
+    bump_definitions_version()
+    form, results['build'] = measure(
+        lambda: form_class(ready_obj=ready_obj))
+    form, results['build_cached'] = measure(
+        lambda: form_class(ready_obj=ready_obj))
+    html, results['render'] = measure(form.as_p)
+    bound = form_class(post_data(form), ready_obj=ready_obj)
+    valid, results['validate'] = measure(bound.is_valid)
+    if not valid:
+        raise ValueError(bound.errors)
+    completed, results['save'] = measure(bound.save)
+    return results
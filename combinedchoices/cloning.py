@@ -0,0 +1,129 @@
+from collections import OrderedDict, defaultdict
+from django.db import transaction
+from django.db.models import Max
+
+from combinedchoices.importers import created_since
+from combinedchoices.models import (
+    BaseCCO, Choice, ChoiceSection, ReadyCCO, Section)
+from combinedchoices.schema import bump_definitions_version
+
+
+def target_sections(sections, user, rename_section=None, batch_size=1000):
+    """
+    Maps each source section id to a section of user. Sections already
+    owned by user are kept unless renamed, otherwise the user's section
+    with the (renamed) name is reused, or a copy is created.
+    """
+    user_id = user.pk if user is not None else None
+    names = {}
+    for section in sections:
+        name = section.field_name
+        if rename_section is not None:
+            name = rename_section(name)
+        names[section.id] = name
+    mapping = dict(
+        (section.id, section.id) for section in sections
+        if section.user_id == user_id and
+        names[section.id] == section.field_name)
+    wanted = set(
+        names[section.id] for section in sections
+        if section.id not in mapping)
+    existing = dict(Section.objects.filter(
+        user=user, field_name__in=wanted).values_list('field_name', 'id'))
+    copies = {}
+    for section in sections:
+        name = names[section.id]
+        if section.id in mapping or name in existing or name in copies:
+            continue
+        copies[name] = Section(
+            user=user, field_name=name, cross_combine=section.cross_combine,
+            lazy_choices=section.lazy_choices,
+            field_type=section.field_type, instructions=section.instructions,
+            min_selects=section.min_selects, max_selects=section.max_selects)
+    if copies:
+        Section.objects.bulk_create(copies.values(), batch_size=batch_size)
+        existing.update(Section.objects.filter(
+            user=user, field_name__in=list(copies)).values_list(
+            'field_name', 'id'))
+    for section in sections:
+        if section.id not in mapping:
+            mapping[section.id] = existing[names[section.id]]
+    return mapping
+
+
+def merged_texts(choices, link_ids):
+    if len(link_ids) == 1:
+        return choices[link_ids[0]]
+    texts = []
+    for link_id in link_ids:
+        texts.extend(
+            text for text in choices[link_id] if text not in texts)
+    return texts
+
+
+def clone_baseccos(baseccos, user, form_names=None, rename_section=None,
+                   batch_size=1000):
+    """
+    Copies baseccos with their ChoiceSection links and choices to user in
+    a fixed number of queries. Returns the copies in the same order.
+    """
+    baseccos = list(baseccos)
+    form_names = form_names or {}
+    with transaction.atomic():
+        links = list(ChoiceSection.objects.filter(
+            basecco__in=baseccos).select_related('section').order_by('id'))
+        choices = defaultdict(list)
+        for choice in Choice.objects.filter(
+                choice_section__in=[link.id for link in links]).order_by('id'):
+            choices[choice.choice_section_id].append(choice.text)
+        sections = dict((link.section_id, link.section) for link in links)
+        section_map = target_sections(
+            list(sections.values()), user, rename_section=rename_section,
+            batch_size=batch_size)
+
+        last_id = BaseCCO.objects.aggregate(last=Max('id'))['last']
+        BaseCCO.objects.bulk_create([
+            BaseCCO(user=user, form_name=form_names.get(
+                basecco.id, basecco.form_name))
+            for basecco in baseccos], batch_size=batch_size)
+        copies = created_since(BaseCCO, last_id, user, len(baseccos))
+        basecco_map = dict(
+            (basecco.id, copy.id) for basecco, copy in zip(baseccos, copies))
+
+        # Renaming can map several sections of one form to the same
+        # section; their links are merged into one.
+        targets = OrderedDict()
+        for link in links:
+            targets.setdefault((
+                basecco_map[link.basecco_id], section_map[link.section_id],
+            ), []).append(link.id)
+        ChoiceSection.objects.bulk_create([
+            ChoiceSection(basecco_id=basecco_id, section_id=section_id)
+            for basecco_id, section_id in targets], batch_size=batch_size)
+        link_map = dict(
+            ((link.basecco_id, link.section_id), link.id)
+            for link in ChoiceSection.objects.filter(basecco__in=copies))
+
+        Choice.objects.bulk_create([
+            Choice(choice_section_id=link_map[key], text=text)
+            for key, link_ids in targets.items()
+            for text in merged_texts(choices, link_ids)],
+            batch_size=batch_size)
+    bump_definitions_version()
+    return copies
+
+
+def clone_ready(ready_obj, user, form_name=None, rename_section=None,
+                batch_size=1000):
+    with transaction.atomic():
+        copies = clone_baseccos(
+            ready_obj.included_forms.order_by('id'), user,
+            rename_section=rename_section, batch_size=batch_size)
+        ready = ReadyCCO.objects.create(
+            user=user, form_name=form_name or ready_obj.form_name)
+        ReadyCCO.included_forms.through.objects.bulk_create([
+            ReadyCCO.included_forms.through(
+                readycco_id=ready.id, basecco_id=copy.id)
+            for copy in copies])
+    bump_definitions_version()
+    return ready
@@ -0,0 +1,181 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections, models
+from django.db.models import Case, Value, When
+from django.utils import six
+from jsonfield.encoder import JSONEncoder
+from jsonfield.fields import JSONFormField
+import base64
+import json
+import zlib
+
+
+ZLIB_PREFIX = 'zlib:'
+
+
+class RawJSON(six.text_type):
+    """
+    Stored form of a CompressedJSONField, as loaded from the database and
+    not decoded yet.
+    """
+
+    @property
+    def compressed(self):
+        return self.startswith(ZLIB_PREFIX)
+
+    def load(self):
+        return decode_json(self)
+
+
+def compress_enabled():
+    return getattr(settings, 'COMBINEDCHOICES_COMPRESS_FORM_DATA', False)
+
+
+def encode_json(value, compress=None):
+    text = json.dumps(value, cls=JSONEncoder, separators=(',', ':'))
+    if compress is None:
+        compress = compress_enabled()
+    if compress:
+        packed = ZLIB_PREFIX + base64.b64encode(
+            zlib.compress(text.encode('utf-8'), 6)).decode('ascii')
+        # Short payloads grow when compressed; keep those readable.
+        if len(packed) < len(text):
+            return RawJSON(packed)
+    return RawJSON(text)
+
+
+def decode_json(raw):
+    if raw is None or raw == '':
+        return None
+    if raw.startswith(ZLIB_PREFIX):
+        raw = zlib.decompress(
+            base64.b64decode(raw[len(ZLIB_PREFIX):])).decode('utf-8')
+    return json.loads(raw)
+
+
+class LazyJSONDescriptor(object):
+
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            return self
+        value = obj.__dict__[self.field.attname]
+        if isinstance(value, RawJSON):
+            value = obj.__dict__[self.field.attname] = value.load()
+        return value
+
+    def __set__(self, obj, value):
+        # Assigned JSON text is decoded; RawJSON from the database waits.
+        if isinstance(value, six.string_types) and not isinstance(
+                value, RawJSON):
+            value = self.field.to_python(value)
+        obj.__dict__[self.field.attname] = value
+
+
+class CompressedJSONField(models.TextField):
+    """
+    JSON stored as text, zlib compressed while
+    COMBINEDCHOICES_COMPRESS_FORM_DATA is set. Rows are decoded on first
+    attribute access; values() and values_list() return the RawJSON text.
+    """
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(CompressedJSONField, self).contribute_to_class(
+            cls, name, **kwargs)
+        setattr(cls, self.name, LazyJSONDescriptor(self))
+
+    def pre_save(self, model_instance, add):
+        # Rows saved without touching the field keep their stored text.
+        return model_instance.__dict__.get(self.attname)
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+        return RawJSON(value)
+
+    def to_python(self, value):
+        # Text from fixtures, forms or assignment, plain or compressed.
+        if isinstance(value, six.string_types):
+            try:
+                return decode_json(value)
+            except (TypeError, ValueError, zlib.error):
+                raise ValidationError('Enter valid JSON', code='invalid')
+        return value
+
+    def get_prep_value(self, value):
+        if value is None and self.null:
+            return None
+        if isinstance(value, RawJSON):
+            return value
+        return encode_json(value)
+
+    def get_default(self):
+        if self.has_default() and callable(self.default):
+            return self.default()
+        return super(CompressedJSONField, self).get_default()
+
+    def value_from_object(self, obj):
+        value = super(CompressedJSONField, self).value_from_object(obj)
+        if value is None and self.null:
+            return None
+        return json.dumps(value, cls=JSONEncoder, indent=2)
+
+    def value_to_string(self, obj):
+        return json.dumps(
+            self._get_val_from_obj(obj), cls=JSONEncoder,
+            separators=(',', ':'))
+
+    def formfield(self, **kwargs):
+        # Edited as text in the admin, like jsonfield.JSONField.
+        kwargs.setdefault('form_class', JSONFormField)
+        return super(CompressedJSONField, self).formfield(**kwargs)
+
+
+def convert_form_data(compress=True, chunk_size=1000):
+    """
+    Rewrites CompletedCCO.form_data in keyset chunks, compressing or
+    expanding it, without decoding rows that are already converted.
+    Returns the number of rows changed.
+    """
+    from combinedchoices.models import CompletedCCO
+    from combinedchoices.routers import sharded_querysets
+    changed = 0
+    for queryset in sharded_querysets(CompletedCCO.objects.all()):
+        changed += convert_shard(queryset, compress, chunk_size)
+    return changed
+
+
+def convert_shard(queryset, compress, chunk_size):
+    changed = 0
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).order_by(
+            'pk').values_list('pk', 'form_data')[:chunk_size])
+        updates = []
+        for pk, raw in rows:
+            if raw is None or raw.compressed == compress:
+                continue
+            converted = encode_json(raw.load(), compress=compress)
+            if converted != raw:
+                updates.append((pk, converted))
+        update_batches(queryset, updates)
+        changed += len(updates)
+        if len(rows) < chunk_size:
+            return changed
+        last_pk = rows[-1][0]
+
+
+def update_batches(queryset, updates):
+    if not updates:
+        return
+    # Each row takes three parameters: the IN list, the WHEN and its value.
+    batch_size = connections[queryset.db].ops.bulk_batch_size(
+        ['pk', 'pk', 'form_data'], updates) or len(updates)
+    for start in range(0, len(updates), batch_size):
+        batch = updates[start:start + batch_size]
+        queryset.filter(pk__in=[pk for pk, raw in batch]).update(
+            form_data=Case(
+                *[When(pk=pk, then=Value(raw)) for pk, raw in batch],
+                output_field=models.TextField()))
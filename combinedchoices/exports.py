@@ -0,0 +1,117 @@
+import csv
+import json
+
+from django.utils import six
+from django.utils.encoding import force_text
+
+from combinedchoices.models import CompletedCCO
+from combinedchoices.routers import shard_dbs, sharded_querysets
+
+
+def completed_queryset(user=None, form_name=None, since=None, until=None):
+    queryset = CompletedCCO.objects.all()
+    if user is not None:
+        queryset = queryset.filter(user=user)
+    if form_name is not None:
+        queryset = queryset.filter(form_name=form_name)
+    if since is not None:
+        queryset = queryset.filter(created__gte=since)
+    if until is not None:
+        queryset = queryset.filter(created__lt=until)
+    return queryset
+
+
+def iter_chunked(queryset, chunk_size=1000):
+    # Keyset pagination keeps memory flat on backends whose cursors
+    # would otherwise buffer the whole result. Sharded completions are
+    # read one shard after another.
+    for shard in sharded_querysets(queryset):
+        last_pk = None
+        while True:
+            chunk = shard.order_by('pk')
+            if last_pk is not None:
+                chunk = chunk.filter(pk__gt=last_pk)
+            chunk = list(chunk[:chunk_size])
+            for obj in chunk:
+                yield obj
+            if len(chunk) < chunk_size:
+                break
+            last_pk = chunk[-1].pk
+
+
+def completed_record(completed):
+    record = {
+        'id': completed.pk,
+        'user': completed.user_id,
+        'form_name': completed.form_name,
+        'created': completed.created.isoformat() if completed.created else None,
+        'form_data': completed.form_data,
+    }
+    if shard_dbs():
+        # Each shard numbers its rows; id is only unique with the shard.
+        record['shard'] = completed._state.db
+    return record
+
+
+def record_name(record):
+    if 'shard' in record:
+        return '%s-%s' % (record['shard'], record['id'])
+    return '%s' % record['id']
+
+
+def iter_records(queryset=None, chunk_size=1000, **filters):
+    if queryset is None:
+        queryset = completed_queryset(**filters)
+    for completed in iter_chunked(queryset, chunk_size=chunk_size):
+        yield completed_record(completed)
+
+
+def flatten_form_data(form_data):
+    flat = {}
+    for field, value in form_data.items():
+        if isinstance(value, dict):
+            for label, number in value.items():
+                flat['%s: %s' % (field, label)] = number
+        elif isinstance(value, (list, tuple)):
+            flat[field] = '; '.join(force_text(item) for item in value)
+        else:
+            flat[field] = value
+    return flat
+
+
+def write_jsonl(records, out):
+    count = 0
+    for record in records:
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+        count += 1
+    return count
+
+
+def csv_text(value):
+    value = '' if value is None else force_text(value)
+    if six.PY2:
+        return value.encode('utf-8')
+    return value
+
+
+def form_data_columns(records):
+    columns = set()
+    for record in records:
+        columns.update(flatten_form_data(record['form_data']).keys())
+    return sorted(columns)
+
+
+def write_csv(records, out, columns):
+    base_columns = ['id', 'user', 'form_name', 'created']
+    if shard_dbs():
+        base_columns.append('shard')
+    writer = csv.writer(out)
+    writer.writerow([csv_text(column) for column in base_columns + columns])
+    count = 0
+    for record in records:
+        flat = flatten_form_data(record['form_data'])
+        writer.writerow(
+            [csv_text(record[column]) for column in base_columns] +
+            [csv_text(flat.get(column)) for column in columns])
+        count += 1
+    return count
@@ -1,15 +1,32 @@
+from collections import OrderedDict
 from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import NoReverseMatch, reverse
+from django.db import IntegrityError, router, transaction
 from django.forms.fields import BooleanField, CharField, MultiValueField
-from django.forms.forms import Form
+from django.forms.forms import BoundField, Form
 from django.forms.models import (
     ModelForm, ModelChoiceField, ModelMultipleChoiceField)
-from django.forms.widgets import (
-    CheckboxSelectMultiple, MultiWidget, NumberInput, RadioSelect, Textarea)
+from django.forms.widgets import CheckboxSelectMultiple, NumberInput, Textarea
 from extra_views import InlineFormSet
 import json
 
+from combinedchoices.fragments import (
+    CachedCheckboxSelectMultiple, CachedMultiWidget, CachedRadioSelect,
+    FragmentCacheMixin)
+from combinedchoices.instrumentation import is_measuring, measure
+from combinedchoices.loaders import ReadyLoader
 from combinedchoices.models import (
-    BaseCCO, Choice, ChoiceSection, CompletedCCO, ReadyCCO, Section)
+    BaseCCO, Choice, ChoiceCount, ChoiceSection, CompletedAnswer, CompletedCCO,
+    ReadyCCO, Section, hash_text, hash_texts)
+from combinedchoices.routers import atomic_all, primary_db
+from combinedchoices.schema import (
+    compile_schema, definitions_version, get_schema, page_choices,
+    section_entry)
+from combinedchoices.snapshots import get_snapshot_id, schema_hash
+from combinedchoices.stats import increment_choice_counts
+from combinedchoices.steps import split_steps
 
 
 class ChoiceLabelMixin(object):
@@ -17,8 +34,38 @@ class ChoiceLabelMixin(object):
         return obj.text
 
 
-class MultiChoice(ChoiceLabelMixin, ModelMultipleChoiceField):
-    pass
+class PreloadedChoiceMixin(object):
+    choice_map = None
+    aliases = None
+
+    def preloaded_choice(self, value, code, params):
+        try:
+            pk = int(value)
+        except (TypeError, ValueError):
+            raise ValidationError(
+                self.error_messages[code], code=code, params=params)
+        if self.aliases:
+            # Merged duplicates, e.g. posted from a page rendered before.
+            pk = self.aliases.get(pk, pk)
+        if pk not in self.choice_map:
+            raise ValidationError(
+                self.error_messages['invalid_choice'], code='invalid_choice',
+                params={'value': value})
+        return Choice(pk=pk, text=self.choice_map[pk])
+
+
+class MultiChoice(
+        PreloadedChoiceMixin, ChoiceLabelMixin, ModelMultipleChoiceField):
+
+    def _check_values(self, value):
+        if self.choice_map is None:
+            return super(MultiChoice, self)._check_values(value)
+        selected = set(
+            self.preloaded_choice(pk, 'invalid_pk_value', {'pk': pk}).pk
+            for pk in value)
+        return [
+            Choice(pk=pk, text=text) for pk, text in self.choice_map.items()
+            if pk in selected]
 
 
 class mNumberWidget(NumberInput):
@@ -41,7 +88,7 @@ class MultiNumberField(ChoiceLabelMixin, MultiValueField):
 
     def __init__(self, fields=(), *args, **kwargs):
         widgets = [field.widget for field in fields]
-        self.widget = MultiWidget(widgets=widgets)
+        self.widget = CachedMultiWidget(widgets=widgets)
         initial = [field.initial for field in fields]
         return super(MultiNumberField, self).__init__(
             fields=fields, *args, initial=initial, **kwargs)
@@ -50,8 +97,21 @@ class MultiNumberField(ChoiceLabelMixin, MultiValueField):
         return json.dumps(values)
 
 
-class SingleChoice(ChoiceLabelMixin, ModelChoiceField):
-    pass
+class SingleChoice(PreloadedChoiceMixin, ChoiceLabelMixin, ModelChoiceField):
+
+    def to_python(self, value):
+        if self.choice_map is None:
+            return super(SingleChoice, self).to_python(value)
+        if value in self.empty_values:
+            return None
+        return self.preloaded_choice(value, 'invalid_choice', {})
+
+
+class MeasuredBoundField(BoundField):
+
+    def as_widget(self, *args, **kwargs):
+        with measure('render_field', lambda: self.form.name_info(self.name)):
+            return super(MeasuredBoundField, self).as_widget(*args, **kwargs)
 
 
 class BaseCCOForm(ModelForm):
@@ -65,6 +125,27 @@ class SectionForm(ModelForm):
         model = Section
         exclude = ['user']
 
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super(SectionForm, self).__init__(*args, **kwargs)
+        if user is not None:
+            self.instance.user = user
+
+    def save(self, commit=True):
+        # (user, field_name) is left to the unique constraint; a clash is
+        # reported as a field_name error and raised for the view.
+        if not commit:
+            return super(SectionForm, self).save(commit=False)
+        try:
+            with transaction.atomic(using=router.db_for_write(Section)):
+                return super(SectionForm, self).save()
+        except IntegrityError:
+            if not self.instance.duplicates().exists():
+                raise
+        error = ValidationError(('Non-Unique Name Error'), code='invalid')
+        self.add_error('field_name', error)
+        raise error
+
 
 class ChoiceSectionForm(ModelForm):
     class Meta:
@@ -91,92 +172,369 @@ class CombineForm(ModelForm):
 
 class ReadyForm(Form):
     form_name = CharField(label='Completed Name')
+    validate_in_memory = True
+    store_answers = None
+    count_choices = None
+    snapshot = None
+    step_size = None
+    cache_fragments = None
 
     def __init__(self, *args, **kwargs):
-        ready_obj = kwargs.pop('ready_obj')
-        filters = self.filters = self.get_filters(ready_obj)
+        ready_obj = self.ready_obj = kwargs.pop('ready_obj')
+        schema = kwargs.pop('schema', None)
+        self.step = kwargs.pop('step', None)
+        self.sections = kwargs.pop('sections', None)
+        self.storage = kwargs.pop('storage', None)
+        final = kwargs.pop('final', None)
+        self.filters = self.get_filters(ready_obj)
         super(ReadyForm, self).__init__(*args, **kwargs)
+        with measure('build', self.instrument_info):
+            if schema is None:
+                schema = self.get_schema(ready_obj)
+            self.schema = schema
+            self.field_sections = dict(
+                (entry['name'], entry['section']) for entry in schema)
+            self.check_step()
+            self.final = self.is_final_step() if final is None else final
+            if not self.final:
+                self.fields.pop('form_name')
+            for entry in self.step_entries():
+                with measure('field', lambda: self.field_info(entry)):
+                    self.create_schema_field(entry)
+
+    @property
+    def steps(self):
+        return split_steps(self.schema, self.get_option(
+            'step_size', 'COMBINEDCHOICES_STEP_SIZE') or 10)
+
+    def step_entries(self):
+        if self.sections is not None:
+            return [
+                entry for entry in self.schema
+                if entry['name'] in self.sections]
+        if self.step is not None:
+            return self.steps[self.step]
+        return self.schema
+
+    def check_step(self):
+        if self.step is None and self.sections is None:
+            return
+        if self.storage is None:
+            raise ValueError('A step or sections form needs a storage')
+        if self.step is not None and not 0 <= self.step < len(self.steps):
+            raise ValueError('Step %s out of range' % self.step)
+
+    def step_key(self):
+        if self.sections is not None:
+            return ','.join(sorted(self.sections))
+        return self.step
+
+    def schema_version(self):
+        # Stored with each step, so steps of an older schema are dropped.
+        if not hasattr(self, '_schema_version'):
+            self._schema_version = schema_hash(self.schema)
+        return self._schema_version
+
+    def missing_names(self):
+        if self.storage is None:
+            return []
+        covered = self.storage.saved_names(
+            exclude='%s' % self.step_key(), version=self.schema_version())
+        covered.update(entry['name'] for entry in self.step_entries())
+        return [
+            entry['name'] for entry in self.schema
+            if entry['name'] not in covered]
+
+    def is_final_step(self):
+        if self.sections is not None:
+            # Final once the other saved steps cover the rest of the form.
+            return not self.missing_names()
+        return self.step is None or self.step == len(self.steps) - 1
+
+    def instrument_info(self):
+        return {
+            'ready_id': self.ready_obj.pk, 'sections': len(self.schema),
+            'choices': sum(len(entry['choices']) for entry in self.schema)}
+
+    def field_info(self, entry):
+        return {
+            'ready_id': self.ready_obj.pk, 'field': entry['name'],
+            'section_id': entry['section'], 'choices': len(entry['choices'])}
+
+    def name_info(self, name):
+        for entry in self.schema:
+            if entry['name'] == name:
+                return self.field_info(entry)
+        return {'ready_id': self.ready_obj.pk, 'field': name}
+
+    @classmethod
+    def load_schema(cls, ready_obj):
+        return cls.get_schema(ready_obj)
+
+    @classmethod
+    def get_schema(cls, ready_obj):
+        return get_schema(
+            ready_obj, lambda: cls.compile_schema(ready_obj),
+            prefix=cls.__name__)
+
+    @classmethod
+    def compile_schema(cls, ready_obj, results=None):
+        with measure('compile', lambda: {'ready_id': ready_obj.pk}):
+            return compile_schema(cls.schema_loader(ready_obj), results)
+
+    @classmethod
+    def schema_loader(cls, ready_obj):
+        filters = cls.get_filters(ready_obj)
         baseccobjs = ready_obj.included_forms.filter(**filters)
-        for section in self.get_sections(baseccobjs, **filters):
-            if section.cross_combine:
-                name = section.field_name
-                queryset = Choice.objects.filter(
-                    choice_section__basecco__in=baseccobjs).order_by('text')
-                self.create_section_field(name, section, queryset)
-            else:
-                for basecc in baseccobjs.filter(sections=section):
-                    name = '%s - %s' % (
-                        basecc.form_name, section.field_name)
-                    queryset = Choice.objects.filter(
-                        choice_section__basecco=basecc)
-                    self.create_section_field(name, section, queryset)
+        # Read from the primary: a lagging replica would otherwise be
+        # cached under the new definitions version.
+        return ReadyLoader(
+            ready_obj, sections=cls.get_sections(baseccobjs, **filters),
+            using=primary_db(), **filters)
+
+    def full_clean(self):
+        with measure('clean', self.instrument_info):
+            if not is_measuring():
+                return super(ReadyForm, self).full_clean()
+            fields = list(self.fields.items())
+            for name, field in fields:
+                self.measure_clean(name, field)
+            try:
+                return super(ReadyForm, self).full_clean()
+            finally:
+                for name, field in fields:
+                    del field.clean
+
+    def measure_clean(self, name, field):
+        # Shadows field.clean for this full_clean only.
+        clean = field.clean
+
+        def measured_clean(value):
+            with measure('clean_field', lambda: self.name_info(name)):
+                return clean(value)
+        field.clean = measured_clean
+
+    def _html_output(self, *args, **kwargs):
+        with measure('render', self.instrument_info):
+            return super(ReadyForm, self)._html_output(*args, **kwargs)
+
+    def __getitem__(self, name):
+        if name in self.fields and name not in self._bound_fields_cache:
+            self._bound_fields_cache[name] = MeasuredBoundField(
+                self, self.fields[name], name)
+        return super(ReadyForm, self).__getitem__(name)
 
     def create_section_field(self, name, basechoice, queryset):
         queryset = queryset.filter(
             choice_section__section=basechoice)
-        if basechoice.field_type in [Section.TEXT, Section.DESCRIPTION]:
+        self.create_schema_field(
+            section_entry(name, basechoice, [], queryset), queryset=queryset)
+
+    def create_schema_field(self, entry, queryset=None):
+        name = entry['name']
+        self.field_sections[name] = entry['section']
+        if queryset is None:
+            queryset = Choice.objects.filter(
+                choice_section__basecco__in=entry['baseccos'],
+                choice_section__section=entry['section'])
+            if entry['cross_combine']:
+                queryset = queryset.order_by('text')
+        if entry['field_type'] in [Section.TEXT, Section.DESCRIPTION]:
             self.fields[name] = CharField(
-                help_text=basechoice.instructions, required=False,
-                initial='\n\n'.join(queryset.values_list('text', flat=True)))
+                help_text=entry['help_text'], required=False,
+                initial=entry['initial'])
             self.fields[name].widget = Textarea()
             self.fields[name].widget.attrs.update({'class':'combo-text'})
-            if basechoice.field_type is Section.DESCRIPTION:
+            if entry['field_type'] == Section.DESCRIPTION:
                 self.fields[name].widget.attrs.update(
                     {'class':'combo-readonly', 'read-only':True})
-        elif basechoice.field_type is Section.SINGLE:
+        elif entry['field_type'] == Section.SINGLE:
             self.fields[name] = SingleChoice(
-                queryset=queryset, help_text=basechoice.instructions,
+                queryset=queryset, help_text=entry['help_text'],
                 empty_label='')
-            self.fields[name].widget = RadioSelect(
-                choices=self.fields[name].choices)
-        elif basechoice.field_type is Section.NUMBER:
+            self.fields[name].widget = CachedRadioSelect(
+                choices=[('', '')] + self.widget_choices(entry))
+        elif entry['field_type'] == Section.NUMBER:
             self.fields[name] = MultiNumberField(
                 fields=[
                     mNumberField(
-                        initial='%s' % basechoice.min_selects, label=label,
-                        required=True)
-                    for label in queryset.values_list('text', flat=True)],
-                help_text=basechoice.instructions)
+                        initial=entry['initial'], label=label, required=True)
+                    for pk, label in entry['choices']],
+                help_text=entry['help_text'])
+            self.fields[name].widget.fragment_key = self.fragment_key(entry)
             return
         else:
             self.fields[name] = MultiChoice(
-                queryset=queryset, help_text=basechoice.instructions)
-            self.fields[name].widget = CheckboxSelectMultiple(
-                choices=self.fields[name].choices)
-        self.fields[name].label = name
+                queryset=queryset, help_text=entry['help_text'])
+            self.fields[name].widget = CachedCheckboxSelectMultiple(
+                choices=self.widget_choices(entry))
+        if self.validate_in_memory and isinstance(
+                self.fields[name], PreloadedChoiceMixin):
+            self.fields[name].choice_map = OrderedDict(entry['choices'])
+            self.fields[name].aliases = dict(entry.get('aliases') or [])
+        if entry.get('lazy'):
+            self.fields[name].widget.attrs.update(self.lazy_attrs(entry))
+        elif isinstance(self.fields[name].widget, FragmentCacheMixin):
+            self.fields[name].widget.fragment_key = self.fragment_key(entry)
+        self.fields[name].label = entry['label']
+
+    def fragment_key(self, entry):
+        if not self.get_option(
+                'cache_fragments', 'COMBINEDCHOICES_CACHE_FRAGMENTS'):
+            return None
+        if not hasattr(self, 'fragment_version'):
+            self.fragment_version = definitions_version()
+        # The BaseCCO ids are hashed to keep long ReadyCCOs under key limits.
+        return '%s:%s:%s:%s' % (
+            type(self).__name__, self.fragment_version, entry['section'],
+            hash_text(','.join('%s' % pk for pk in entry['baseccos'])))
+
+    def widget_choices(self, entry):
+        if not entry.get('lazy'):
+            return list(entry['choices'])
+        choices = page_choices(entry)[0]
+        if self.is_bound:
+            key = self.add_prefix(entry['name'])
+            if hasattr(self.data, 'getlist'):
+                selected = self.data.getlist(key)
+            else:
+                selected = self.data.get(key)
+                if not isinstance(selected, (list, tuple)):
+                    selected = [selected]
+            selected = set('%s' % value for value in selected).difference(
+                '%s' % pk for pk, text in choices)
+            choices.extend(
+                (pk, text) for pk, text in entry['choices']
+                if '%s' % pk in selected)
+        return choices
+
+    def lazy_attrs(self, entry):
+        attrs = {'data-lazy-field': entry['name']}
+        try:
+            attrs['data-lazy-url'] = reverse(
+                'combinedchoices-choices', args=[self.ready_obj.pk])
+        except NoReverseMatch:
+            pass
+        return attrs
 
-    def get_filters(self, ready_obj):
-        return {'user':ready_obj.user}
+    # Classmethods, so the schema can be loaded without building a form.
+    @classmethod
+    def get_filters(cls, ready_obj):
+        return {'user_id':ready_obj.user_id}
 
-    def get_sections(self, compendiums, **kwargs):
+    @classmethod
+    def get_sections(cls, compendiums, **kwargs):
         kwargs.update({'choicesection__basecco__in':compendiums})
         return Section.objects.filter(**kwargs)
 
+    def clean(self):
+        cleaned_data = super(ReadyForm, self).clean()
+        if self.final:
+            missing = self.missing_names()
+            if missing:
+                raise ValidationError(
+                    'Earlier steps are missing: %(names)s',
+                    code='incomplete', params={'names': ', '.join(missing)})
+        return cleaned_data
+
     def save(self, *args, **kwargs):
+        with measure('save', self.instrument_info):
+            if not self.final:
+                name, completed, answers = self.completed_data()
+                return self.storage.save_step(
+                    self.step_key(), completed, answers,
+                    [entry['name'] for entry in self.step_entries()],
+                    version=self.schema_version())
+            completed_obj = self.create_completed(*args, **kwargs)
+            if self.storage is not None:
+                self.storage.clear()
+            return completed_obj
+
+    def completed_data(self):
         completed = {}
-        name = self.cleaned_data.pop('form_name')
-        self.fields.pop('form_name')
+        answers = []
+        name = self.cleaned_data.pop('form_name', None)
+        self.fields.pop('form_name', None)
         for field in self.fields.keys():
             data = self.cleaned_data[field]
             if not data:
                 pass
             elif type(self.fields[field]) is CharField:
                 completed[field] = data
+                answers.append((field, None, data, ''))
             elif type(self.fields[field]) is SingleChoice:
                 completed[field] = data.text
+                answers.append((field, data.pk, data.text, ''))
             elif type(self.fields[field]) in [MultiChoice]:
                 completed[field] = []
                 for choice in self.cleaned_data[field]:
                     completed[field].append(choice.text)
+                    answers.append((field, choice.pk, choice.text, ''))
             elif type(self.fields[field]) is MultiNumberField:
                 data = json.loads(data)
                 completed[field] = {}
                 for subfield in range(len(data)):
-                    completed[field][
-                        self.fields[field].fields[subfield].label
-                        ] = data[subfield]
+                    label = self.fields[field].fields[subfield].label
+                    completed[field][label] = data[subfield]
+                    answers.append((field, None, label, data[subfield]))
             else:
                 raise NotImplementedError()
+        return name, completed, answers
+
+    def completed_kwargs(self, **kwargs):
         kwargs.update(self.filters)
-        return CompletedCCO.objects.create(
+        kwargs.setdefault('ready', self.ready_obj)
+        if self.get_option('snapshot', 'COMBINEDCHOICES_SNAPSHOTS'):
+            kwargs.setdefault(
+                'snapshot_id', get_snapshot_id(self.ready_obj, self.schema))
+        return kwargs
+
+    def choice_picks(self, answers):
+        return set(
+            (field, text) for field, choice_id, text, value in answers
+            if choice_id is not None)
+
+    def answer_rows(self, completed_obj, answers):
+        return hash_texts([
+            CompletedAnswer(
+                completed=completed_obj, field_name=field,
+                section_id=self.field_sections.get(field),
+                choice_id=choice_id, text=text, value=value)
+            for field, choice_id, text, value in answers])
+
+    def create_completed(self, *args, **kwargs):
+        name, completed, answers = self.completed_data()
+        if self.storage is not None:
+            completed, answers = self.storage.merge(
+                completed, answers, exclude='%s' % self.step_key(),
+                version=self.schema_version())
+        kwargs = self.completed_kwargs(**kwargs)
+        store_answers = self.get_option(
+            'store_answers', 'COMBINEDCHOICES_STORE_ANSWERS')
+        count_choices = self.get_option(
+            'count_choices', 'COMBINEDCHOICES_COUNT_CHOICES')
+        completed_obj = CompletedCCO(
             form_name=name, form_data=completed, **kwargs)
+        using = router.db_for_write(CompletedCCO, instance=completed_obj)
+        if not (store_answers or count_choices):
+            completed_obj.save(force_insert=True, using=using)
+            return completed_obj
+        aliases = [using]
+        if count_choices:
+            # Counters are not sharded; they commit with the completion.
+            aliases.append(router.db_for_write(ChoiceCount))
+        with atomic_all(aliases):
+            completed_obj.save(force_insert=True, using=using)
+            if store_answers:
+                CompletedAnswer.objects.using(using).bulk_create(
+                    self.answer_rows(completed_obj, answers))
+            if count_choices and completed_obj.ready_id:
+                increment_choice_counts(
+                    completed_obj.ready_id, self.choice_picks(answers))
+        return completed_obj
+
+    def get_option(self, attr, setting):
+        value = getattr(self, attr)
+        if value is None:
+            return getattr(settings, setting, False)
+        return value
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.forms.widgets import (
+    CheckboxSelectMultiple, MultiWidget, RadioSelect)
+from django.utils.encoding import force_text
+from django.utils.safestring import mark_safe
+
+from combinedchoices.models import hash_text
+from combinedchoices.schema import get_cache
+
+
+FRAGMENT_KEY = 'combinedchoices:fragment:%s:%s'
+
+
+class FragmentCacheMixin(object):
+    """
+    Caches the rendered HTML of a widget under fragment_key, which the
+    form sets from the section, its BaseCCOs and the definitions version.
+    Widgets without a fragment_key render as usual.
+    """
+    fragment_key = None
+
+    def cached_fragment(self, name, value, attrs, extra=''):
+        key = FRAGMENT_KEY % (self.fragment_key, hash_text(repr((
+            name, sorted(self.build_attrs(attrs).items()), extra))))
+        cache = get_cache()
+        html = cache.get(key)
+        if html is None:
+            html = force_text(
+                super(FragmentCacheMixin, self).render(name, value, attrs))
+            cache.set(key, html, getattr(
+                settings, 'COMBINEDCHOICES_SCHEMA_TIMEOUT', None))
+        return html
+
+
+class ChoiceFragmentMixin(FragmentCacheMixin):
+    # Cached with nothing selected; a bound value only re-renders and
+    # swaps in the inputs it checks.
+
+    def render(self, name, value, attrs=None, choices=()):
+        if self.fragment_key is None or choices:
+            return super(ChoiceFragmentMixin, self).render(
+                name, value, attrs, choices)
+        html = self.cached_fragment(name, [], attrs)
+        patched = self.check_inputs(html, name, value, attrs)
+        if patched is None:
+            return super(ChoiceFragmentMixin, self).render(
+                name, value, attrs, choices)
+        return mark_safe(patched)
+
+    def check_inputs(self, html, name, value, attrs):
+        if value is None:
+            value = self._empty_value
+        if isinstance(value, (list, tuple, set)):
+            selected = set(force_text(v) for v in value)
+        else:
+            selected = set([force_text(value)])
+        renderer = self.get_renderer(name, [], attrs)
+        for index, choice in enumerate(renderer.choices):
+            if force_text(choice[0]) not in selected:
+                continue
+            unchecked = renderer.choice_input_class(
+                name, [], renderer.attrs.copy(), choice, index).tag()
+            checked = renderer.choice_input_class(
+                name, value, renderer.attrs.copy(), choice, index).tag()
+            if html.count(unchecked) != 1:
+                return None
+            html = html.replace(unchecked, checked)
+        return html
+
+
+class CachedRadioSelect(ChoiceFragmentMixin, RadioSelect):
+    pass
+
+
+class CachedCheckboxSelectMultiple(
+        ChoiceFragmentMixin, CheckboxSelectMultiple):
+    pass
+
+
+class CachedMultiWidget(FragmentCacheMixin, MultiWidget):
+    # Cached with every input empty; values are swapped in per input, so
+    # submitted data never becomes part of a cache key.
+
+    def render(self, name, value, attrs=None):
+        if self.fragment_key is None:
+            return super(CachedMultiWidget, self).render(name, value, attrs)
+        html = self.cached_fragment(name, [], attrs)
+        patched = self.fill_inputs(html, name, value, attrs)
+        if patched is None:
+            return super(CachedMultiWidget, self).render(name, value, attrs)
+        return mark_safe(patched)
+
+    def fill_inputs(self, html, name, value, attrs):
+        if not isinstance(value, list):
+            return None
+        final_attrs = self.build_attrs(attrs)
+        id_ = final_attrs.get('id', None)
+        for index, widget in enumerate(self.widgets):
+            widget_value = value[index] if index < len(value) else None
+            if widget_value is None or widget_value == '':
+                continue
+            if id_:
+                final_attrs = dict(final_attrs, id='%s_%s' % (id_, index))
+            widget_name = '%s_%s' % (name, index)
+            empty = widget.render(widget_name, None, final_attrs)
+            filled = widget.render(widget_name, widget_value, final_attrs)
+            if html.count(empty) != 1:
+                return None
+            html = html.replace(empty, filled)
+        return html
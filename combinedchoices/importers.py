@@ -0,0 +1,113 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+import json
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from combinedchoices.models import BaseCCO, Choice, ChoiceSection, Section
+from combinedchoices.schema import bump_definitions_version
+
+
+SECTION_DEFAULTS = {
+    'cross_combine': True, 'instructions': '', 'min_selects': 1,
+    'max_selects': 1}
+SECTION_FIELDS = (
+    'cross_combine', 'field_name', 'field_type', 'instructions',
+    'lazy_choices', 'max_selects', 'min_selects')
+
+
+def load_definition(path):
+    with open(path) as definition_file:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ImportError('PyYAML is required to import YAML files')
+            return yaml.safe_load(definition_file)
+        return json.load(definition_file)
+
+
+def parse_field_type(value):
+    name = ('%s' % value).lower()
+    for field_type, type_name in Section.CHOICE_TYPES:
+        if name in ('%s' % field_type, type_name.lower()):
+            return field_type
+    raise ValidationError(
+        'Unknown field type: %(value)s', code='invalid',
+        params={'value': value})
+
+
+def build_sections(definitions, user):
+    names = set()
+    sections = []
+    for definition in definitions:
+        unknown = sorted(set(definition) - set(SECTION_FIELDS))
+        if unknown:
+            raise ValidationError(
+                'Unknown section keys: %(keys)s', code='invalid',
+                params={'keys': ', '.join(unknown)})
+        section = Section(user=user, **dict(SECTION_DEFAULTS, **dict(
+            (key, value) for key, value in definition.items()
+            if key != 'field_type')))
+        section.field_type = parse_field_type(definition.get('field_type'))
+        if section.field_name in names:
+            raise ValidationError(('Non-Unique Name Error'), code='invalid')
+        names.add(section.field_name)
+        sections.append(section)
+    if Section.objects.filter(user=user, field_name__in=names).exists():
+        raise ValidationError(('Non-Unique Name Error'), code='invalid')
+    return sections
+
+
+def created_since(model, last_id, user, count):
+    created = list(model.objects.filter(
+        user=user, id__gt=last_id or 0).order_by('id'))
+    if len(created) != count:
+        raise ValidationError(
+            'Concurrent %(model)s writes during import', code='invalid',
+            params={'model': model.__name__})
+    return created
+
+
+def import_definition(definition, user=None, batch_size=1000):
+    with transaction.atomic():
+        sections = build_sections(definition.get('sections', []), user)
+        Section.objects.bulk_create(sections, batch_size=batch_size)
+        section_ids = dict(Section.objects.filter(user=user).values_list(
+            'field_name', 'id'))
+
+        forms = definition.get('baseccos', [])
+        last_id = BaseCCO.objects.aggregate(last=Max('id'))['last']
+        BaseCCO.objects.bulk_create(
+            [BaseCCO(user=user, form_name=form['form_name'])
+             for form in forms], batch_size=batch_size)
+        baseccos = created_since(BaseCCO, last_id, user, len(forms))
+
+        links = []
+        for basecco, form in zip(baseccos, forms):
+            for field_name in form.get('sections', {}):
+                if field_name not in section_ids:
+                    raise ValidationError(
+                        'Unknown section: %(name)s', code='invalid',
+                        params={'name': field_name})
+                links.append(ChoiceSection(
+                    basecco=basecco, section_id=section_ids[field_name]))
+        ChoiceSection.objects.bulk_create(links, batch_size=batch_size)
+        choice_sections = dict(
+            ((cs.basecco_id, cs.section_id), cs.id)
+            for cs in ChoiceSection.objects.filter(basecco__in=baseccos))
+
+        choices = []
+        for basecco, form in zip(baseccos, forms):
+            for field_name, texts in form.get('sections', {}).items():
+                cs_id = choice_sections[(basecco.id, section_ids[field_name])]
+                choices.extend(
+                    Choice(choice_section_id=cs_id, text=text)
+                    for text in texts or [])
+        Choice.objects.bulk_create(choices, batch_size=batch_size)
+    bump_definitions_version()
+    return {
+        'sections': len(sections), 'baseccos': len(baseccos),
+        'choice_sections': len(links), 'choices': len(choices)}
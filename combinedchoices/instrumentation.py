@@ -0,0 +1,184 @@
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+from django.utils.module_loading import import_string
+import logging
+import threading
+import time
+
+
+collectors = []
+active = threading.local()
+
+
+def register(collector):
+    if collector not in collectors:
+        collectors.append(collector)
+    return collector
+
+
+def unregister(collector):
+    if collector in collectors:
+        collectors.remove(collector)
+
+
+def register_from_settings():
+    for path in getattr(settings, 'COMBINEDCHOICES_INSTRUMENTATION', []):
+        register(import_string(path)())
+
+
+class Event(object):
+
+    def __init__(self, phase, seconds, queries, **info):
+        self.phase = phase
+        self.seconds = seconds
+        self.queries = queries
+        self.info = info
+
+    def __repr__(self):
+        return '<Event %s %.4fs %s queries %s>' % (
+            self.phase, self.seconds, self.queries, self.info)
+
+
+class LoggingCollector(object):
+
+    def __init__(self, logger='combinedchoices.instrumentation',
+                 level=logging.DEBUG):
+        self.logger = logging.getLogger(logger)
+        self.level = level
+
+    def __call__(self, event):
+        self.logger.log(
+            self.level, '%s took %.4fs and %s queries %s', event.phase,
+            event.seconds, event.queries, event.info)
+
+
+class MemoryCollector(object):
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def __enter__(self):
+        return register(self)
+
+    def __exit__(self, *exc_info):
+        unregister(self)
+
+    def phase(self, phase):
+        return [event for event in self.events if event.phase == phase]
+
+
+def active_measurements():
+    if not hasattr(active, 'measurements'):
+        active.measurements = []
+    return active.measurements
+
+
+class CountingCursorWrapper(CursorWrapper):
+    """
+    Adds each query to the measurements open in this thread, then hands
+    it to the cursor the connection would have used anyway.
+    """
+
+    def count(self):
+        for measurement in active_measurements():
+            measurement.queries += 1
+
+    def execute(self, sql, params=None):
+        self.count()
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.count()
+        return self.cursor.executemany(sql, param_list)
+
+    def callproc(self, procname, params=None):
+        self.count()
+        return self.cursor.callproc(procname, params)
+
+
+CURSOR_FACTORIES = ('make_cursor', 'make_debug_cursor')
+
+
+def count_queries(connection):
+    # Connections are per thread; each is wrapped while this thread has a
+    # measurement open.
+    if hasattr(connection, 'uncounted'):
+        return
+    connection.uncounted = dict(
+        (name, vars(connection).get(name)) for name in CURSOR_FACTORIES)
+    make_cursor = connection.make_cursor
+    make_debug_cursor = connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: CountingCursorWrapper(
+        make_cursor(cursor), connection)
+    connection.make_debug_cursor = lambda cursor: CountingCursorWrapper(
+        make_debug_cursor(cursor), connection)
+
+
+def uncount_queries(connection):
+    uncounted = vars(connection).pop('uncounted', None)
+    if uncounted is None:
+        return
+    for name, original in uncounted.items():
+        if original is None:
+            delattr(connection, name)
+        else:
+            setattr(connection, name, original)
+
+
+def is_measuring():
+    return bool(collectors)
+
+
+class Measurement(object):
+
+    def __init__(self, phase, info):
+        self.phase = phase
+        self.info = info
+        self.queries = 0
+
+    def __enter__(self):
+        if not active_measurements():
+            for connection in connections.all():
+                count_queries(connection)
+        active_measurements().append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.start
+        active_measurements().remove(self)
+        if not active_measurements():
+            for connection in connections.all():
+                uncount_queries(connection)
+        if exc_info[0] is not None:
+            return
+        info = self.info() if self.info is not None else {}
+        event = Event(self.phase, seconds, self.queries, **info)
+        for collector in list(collectors):
+            collector(event)
+
+
+class NullMeasurement(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+NULL_MEASUREMENT = NullMeasurement()
+
+
+def measure(phase, info=None):
+    """
+    Times the wrapped block for the registered collectors. info is a
+    callable so event details are only computed while something listens.
+    """
+    if not collectors:
+        return NULL_MEASUREMENT
+    return Measurement(phase, info)
@@ -0,0 +1,83 @@
+from collections import defaultdict, OrderedDict
+
+from combinedchoices.models import Choice, ChoiceSection, Section
+
+
+class ReadyLoader(object):
+    """
+    Loads the BaseCCO, Section and Choice rows behind a ReadyCCO in three
+    queries, however many sections or included forms there are.
+    """
+
+    def __init__(self, ready_obj, sections=None, using=None, **filters):
+        self.ready_obj = ready_obj
+        self.using = using
+        self.filters = filters
+        if sections is None:
+            sections = Section.objects.filter(**filters)
+        self.section_queryset = sections
+
+    def queries(self, basecco_ids=None):
+        """
+        The three querysets behind load(). Without basecco_ids they only
+        depend on the ReadyCCO, so they can be evaluated concurrently.
+        """
+        baseccos = self.ready_obj.included_forms.db_manager(
+            self.using).filter(**self.filters).order_by('id')
+        if basecco_ids is None:
+            basecco_ids = baseccos.values('id')
+        choice_sections = ChoiceSection.objects.db_manager(
+            self.using).filter(
+            basecco__in=basecco_ids, section__in=self.section_queryset,
+        ).select_related('section').order_by('section', 'basecco', 'id')
+        choices = Choice.objects.db_manager(self.using).filter(
+            choice_section__basecco__in=basecco_ids,
+            choice_section__section__in=self.section_queryset,
+        ).order_by('id')
+        return baseccos, choice_sections, choices
+
+    def load(self):
+        baseccos = list(self.queries()[0])
+        return self.populate(baseccos, *self.queries(
+            [basecco.id for basecco in baseccos])[1:])
+
+    def populate(self, baseccos, choice_sections, choices):
+        self.baseccos = list(baseccos)
+        self.sections = OrderedDict()
+        self.links = defaultdict(list)
+        self.choice_sections = defaultdict(list)
+        for choice_section in choice_sections:
+            key = (choice_section.basecco_id, choice_section.section_id)
+            self.sections.setdefault(
+                choice_section.section_id, choice_section.section)
+            if key not in self.choice_sections:
+                self.links[choice_section.section_id].append(
+                    choice_section.basecco_id)
+            self.choice_sections[key].append(choice_section.id)
+        self.choices = defaultdict(list)
+        for choice in choices:
+            self.choices[choice.choice_section_id].append(choice)
+        return self
+
+    def section_choices(self, section, basecco_ids):
+        choices = []
+        for basecco_id in basecco_ids:
+            for cs_id in self.choice_sections[(basecco_id, section.id)]:
+                choices.extend(self.choices[cs_id])
+        return choices
+
+    def iter_fields(self):
+        baseccos = dict((basecco.id, basecco) for basecco in self.baseccos)
+        for section_id, section in self.sections.items():
+            linked = self.links[section_id]
+            if section.cross_combine:
+                choices = sorted(
+                    self.section_choices(section, linked),
+                    key=lambda choice: choice.text)
+                yield section.field_name, section, linked, choices
+            else:
+                for basecco_id in linked:
+                    name = '%s - %s' % (
+                        baseccos[basecco_id].form_name, section.field_name)
+                    yield name, section, [basecco_id], self.section_choices(
+                        section, [basecco_id])
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from combinedchoices.benchmarks import PHASES, make_dataset, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures queries, time and peak memory of ReadyForm build, render, '
+        'validate and save on generated data. Data is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1)
+        parser.add_argument('--baseccos', type=int, default=5)
+        parser.add_argument('--sections-per-type', type=int, default=2)
+        parser.add_argument('--choices-per-section', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            readies = make_dataset(
+                users=options['users'], baseccos=options['baseccos'],
+                sections_per_type=options['sections_per_type'],
+                choices_per_section=options['choices_per_section'])
+            self.stdout.write('%-14s %8s %10s %12s' % (
+                'phase', 'queries', 'seconds', 'peak bytes'))
+            for ready in readies:
+                results = run_benchmark(ready)
+                for phase in PHASES:
+                    result = results[phase]
+                    self.stdout.write('%-14s %8s %10.4f %12s' % (
+                        phase, result['queries'], result['seconds'],
+                        result['peak_memory'] or '-'))
+            transaction.set_rollback(True)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from combinedchoices.compression import convert_form_data
+
+
+class Command(BaseCommand):
+    help = 'Compresses, or with --expand decompresses, stored form_data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--expand', action='store_true', default=False)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        changed = convert_form_data(
+            compress=not options['expand'], chunk_size=options['chunk_size'])
+        self.stdout.write('Converted form_data of %s CompletedCCOs' % changed)
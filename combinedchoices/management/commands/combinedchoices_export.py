@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.utils import six
+
+from combinedchoices.exports import (
+    form_data_columns, iter_records, write_csv, write_jsonl)
+from combinedchoices.management.filters import (
+    add_filter_arguments, filtered_queryset)
+
+
+class Command(BaseCommand):
+    help = 'Streams CompletedCCO records as JSON lines or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=['jsonl', 'csv'], default='jsonl')
+        parser.add_argument('--output', help='File path, defaults to stdout.')
+        add_filter_arguments(parser)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        queryset = filtered_queryset(options)
+        records = lambda: iter_records(
+            queryset, chunk_size=options['chunk_size'])
+        if not options['output']:
+            out = self.stdout
+        elif six.PY2:
+            out = open(options['output'], 'wb')
+        else:
+            out = open(options['output'], 'w', newline='')
+        try:
+            if options['format'] == 'csv':
+                count = write_csv(records(), out, form_data_columns(records()))
+            else:
+                count = write_jsonl(records(), out)
+        finally:
+            if options['output']:
+                out.close()
+        self.stderr.write('Exported %s records' % count)
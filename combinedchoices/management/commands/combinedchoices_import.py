@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from combinedchoices.importers import import_definition, load_definition
+
+
+class Command(BaseCommand):
+    help = 'Imports BaseCCO, Section and Choice definitions from JSON or YAML.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', help='Username owning the definitions.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError('Unknown user: %s' % options['user'])
+        try:
+            counts = import_definition(
+                load_definition(options['path']), user=user,
+                batch_size=options['batch_size'])
+        except (ImportError, ValidationError) as error:
+            raise CommandError(error)
+        self.stdout.write(', '.join(
+            '%s %s' % (counts[key], key) for key in
+            ('sections', 'baseccos', 'choice_sections', 'choices')))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+import os
+
+from combinedchoices.management.filters import (
+    add_filter_arguments, filtered_queryset)
+from combinedchoices.printing import EXTENSIONS, render_completed
+
+
+class Command(BaseCommand):
+    help = 'Renders CompletedCCO records to HTML or text for printing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=sorted(EXTENSIONS), default='html')
+        parser.add_argument(
+            '--output-dir', help='Write one file per completion here.')
+        parser.add_argument(
+            '--output-file', help='Write all completions to one file.')
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help='Worker processes, defaults to the CPU count.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        add_filter_arguments(parser)
+
+    def handle(self, *args, **options):
+        if bool(options['output_dir']) == bool(options['output_file']):
+            raise CommandError(
+                'Give exactly one of --output-dir or --output-file.')
+        if options['output_dir'] and not os.path.isdir(options['output_dir']):
+            os.makedirs(options['output_dir'])
+        queryset = filtered_queryset(options)
+        stats = render_completed(
+            queryset, output_dir=options['output_dir'],
+            output_file=options['output_file'], output_format=options['format'],
+            processes=options['processes'], chunk_size=options['chunk_size'])
+        self.stdout.write(
+            'Rendered %(count)s completions (%(bytes)s bytes) in '
+            '%(seconds).2fs, %(per_second).1f per second' % stats)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from combinedchoices.models import ReadyCCO
+from combinedchoices.stats import rebuild_choice_counts
+
+
+class Command(BaseCommand):
+    help = 'Recomputes ChoiceCount rows from existing CompletedCCO data.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ready', type=int, action='append',
+            help='ReadyCCO id to rebuild, may be repeated. Defaults to all.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        readies = ReadyCCO.objects.all()
+        if options['ready']:
+            readies = readies.filter(id__in=options['ready'])
+        rebuilt = rebuild_choice_counts(
+            readies, chunk_size=options['chunk_size'])
+        self.stdout.write('Rebuilt choice counts for %s ReadyCCOs' % rebuilt)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from combinedchoices.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Creates and repopulates the full-text index over Choice text.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        if not rebuild_index(options['database']):
+            raise CommandError(
+                'No full-text index is available on this database; '
+                'search falls back to icontains.')
+        self.stdout.write('Rebuilt the Choice search index')
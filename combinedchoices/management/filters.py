@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from combinedchoices.exports import completed_queryset
+
+
+def add_filter_arguments(parser):
+    parser.add_argument('--user', help='Username to include.')
+    parser.add_argument('--form-name')
+    parser.add_argument('--since', help='ISO date or datetime, inclusive.')
+    parser.add_argument('--until', help='ISO date or datetime, exclusive.')
+
+
+def parse_moment(value):
+    if value is None:
+        return None
+    moment = parse_datetime(value) or parse_datetime(value + 'T00:00:00')
+    if moment is None:
+        raise CommandError('Invalid date: %s' % value)
+    if settings.USE_TZ and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filtered_queryset(options):
+    user = None
+    if options['user']:
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('Unknown user: %s' % options['user'])
+    return completed_queryset(
+        user=user, form_name=options['form_name'],
+        since=parse_moment(options['since']),
+        until=parse_moment(options['until']))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BaseCCO',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('form_name', models.CharField(max_length=64)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Choice',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('text', models.TextField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChoiceSection',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('basecco', models.ForeignKey(to='combinedchoices.BaseCCO')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CompletedCCO',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('form_name', models.CharField(max_length=64)),
+                ('form_data', jsonfield.fields.JSONField(default={})),
+                ('user', models.ForeignKey(blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ReadyCCO',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('form_name', models.CharField(max_length=64)),
+                ('included_forms', models.ManyToManyField(to='combinedchoices.BaseCCO')),
+                ('user', models.ForeignKey(blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Section',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('cross_combine', models.BooleanField(default=True)),
+                ('field_name', models.CharField(max_length=64)),
+                ('field_type', models.IntegerField(choices=[(0, b'Description'), (1, b'Single'), (2, b'Multiple'), (3, b'Number'), (4, b'Text')])),
+                ('instructions', models.TextField(default=b'', blank=True)),
+                ('min_selects', models.IntegerField(default=1)),
+                ('max_selects', models.IntegerField(default=1)),
+                ('user', models.ForeignKey(blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='choicesection',
+            name='section',
+            field=models.ForeignKey(to='combinedchoices.Section'),
+        ),
+        migrations.AddField(
+            model_name='choice',
+            name='choice_section',
+            field=models.ForeignKey(to='combinedchoices.ChoiceSection'),
+        ),
+        migrations.AddField(
+            model_name='basecco',
+            name='sections',
+            field=models.ManyToManyField(to='combinedchoices.Section', through='combinedchoices.ChoiceSection', blank=True),
+        ),
+        migrations.AddField(
+            model_name='basecco',
+            name='user',
+            field=models.ForeignKey(blank=True, to=settings.AUTH_USER_MODEL, null=True),
+        ),
+    ]
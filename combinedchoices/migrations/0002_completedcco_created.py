@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='completedcco',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now_add=True, db_index=True),
+            preserve_default=False,
+        ),
+    ]
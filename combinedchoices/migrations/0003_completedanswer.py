@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0002_completedcco_created'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompletedAnswer',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('field_name', models.CharField(max_length=255, db_index=True)),
+                ('text', models.TextField(blank=True)),
+                ('text_hash', models.CharField(max_length=40, db_index=True)),
+                ('value', models.TextField(default=b'', blank=True)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.Choice', null=True)),
+                ('completed', models.ForeignKey(related_name='answers', to='combinedchoices.CompletedCCO')),
+                ('section', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.Section', null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='completedanswer',
+            index_together=set([('field_name', 'text_hash')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0003_completedanswer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='completedcco',
+            name='ready',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.ReadyCCO', null=True),
+        ),
+        migrations.CreateModel(
+            name='ChoiceCount',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('field_name', models.CharField(max_length=255)),
+                ('text', models.TextField(blank=True)),
+                ('text_hash', models.CharField(max_length=40)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('ready', models.ForeignKey(to='combinedchoices.ReadyCCO')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='choicecount',
+            unique_together=set([('ready', 'field_name', 'text_hash')]),
+        ),
+    ]
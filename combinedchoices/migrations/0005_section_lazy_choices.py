@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0004_choicecount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='section',
+            name='lazy_choices',
+            field=models.BooleanField(default=False),
+        ),
+    ]
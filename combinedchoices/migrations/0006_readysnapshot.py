@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0005_section_lazy_choices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadySnapshot',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('schema', jsonfield.fields.JSONField(default=[])),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('ready', models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.ReadyCCO', null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='completedcco',
+            name='snapshot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.ReadySnapshot', null=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='readysnapshot',
+            unique_together=set([('ready', 'content_hash'), ('ready', 'version')]),
+        ),
+    ]
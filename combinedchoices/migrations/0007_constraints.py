@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def rename_duplicate_sections(apps, schema_editor):
+    # Later copies of a (user, field_name) pair get their id appended;
+    # NULL users never collide in the index and are left alone.
+    Section = apps.get_model('combinedchoices', 'Section')
+    sections = Section.objects.using(schema_editor.connection.alias)
+    duplicates = sections.filter(user__isnull=False).values(
+        'user_id', 'field_name').annotate(
+        copies=models.Count('id')).filter(copies__gt=1)
+    for duplicate in duplicates:
+        taken = set(sections.filter(user_id=duplicate['user_id']).values_list(
+            'field_name', flat=True))
+        for section in sections.filter(
+                user_id=duplicate['user_id'],
+                field_name=duplicate['field_name']).order_by('id')[1:]:
+            name = section.field_name
+            attempt = 0
+            while name in taken:
+                attempt += 1
+                suffix = ' (%s)' % '-'.join(
+                    ['%s' % section.id] + ['%s' % attempt] * (attempt > 1))
+                name = section.field_name[:64 - len(suffix)] + suffix
+            taken.add(name)
+            sections.filter(id=section.id).update(field_name=name)
+
+
+def merge_duplicate_links(apps, schema_editor):
+    # Choices of repeated (basecco, section) links move to the first one.
+    ChoiceSection = apps.get_model('combinedchoices', 'ChoiceSection')
+    Choice = apps.get_model('combinedchoices', 'Choice')
+    alias = schema_editor.connection.alias
+    links = ChoiceSection.objects.using(alias)
+    duplicates = links.values('basecco_id', 'section_id').annotate(
+        copies=models.Count('id')).filter(copies__gt=1)
+    for duplicate in duplicates:
+        ids = list(links.filter(
+            basecco_id=duplicate['basecco_id'],
+            section_id=duplicate['section_id']).order_by('id').values_list(
+            'id', flat=True))
+        Choice.objects.using(alias).filter(
+            choice_section_id__in=ids[1:]).update(choice_section_id=ids[0])
+        links.filter(id__in=ids[1:]).delete()
+
+
+def dedupe(apps, schema_editor):
+    rename_duplicate_sections(apps, schema_editor)
+    merge_duplicate_links(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0006_readysnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='choicesection',
+            unique_together=set([('basecco', 'section')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='section',
+            unique_together=set([('user', 'field_name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='basecco',
+            index_together=set([('user', 'form_name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='completedcco',
+            index_together=set([('user', 'form_name')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='readycco',
+            index_together=set([('user', 'form_name')]),
+        ),
+    ]
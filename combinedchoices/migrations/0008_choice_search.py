@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import DatabaseError, migrations, transaction
+
+# A copy of combinedchoices.search at the time of this migration; the live
+# module may change without changing what this migration did.
+FTS_TABLE = 'combinedchoices_choice_fts'
+TRIGRAM_INDEX = 'combinedchoices_choice_text_trgm'
+
+SQLITE_INSTALL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS %(fts)s USING fts5("
+    "text, content='%(table)s', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS %(fts)s_ai AFTER INSERT ON %(table)s BEGIN "
+    "INSERT INTO %(fts)s(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS %(fts)s_ad AFTER DELETE ON %(table)s BEGIN "
+    "INSERT INTO %(fts)s(%(fts)s, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS %(fts)s_au AFTER UPDATE OF text "
+    "ON %(table)s BEGIN "
+    "INSERT INTO %(fts)s(%(fts)s, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO %(fts)s(rowid, text) VALUES (new.id, new.text); END",
+    "INSERT INTO %(fts)s(%(fts)s) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS %(fts)s_ai',
+    'DROP TRIGGER IF EXISTS %(fts)s_ad',
+    'DROP TRIGGER IF EXISTS %(fts)s_au',
+    'DROP TABLE IF EXISTS %(fts)s',
+]
+POSTGRESQL_INSTALL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX %(index)s ON %(table)s USING gin (text gin_trgm_ops)',
+]
+POSTGRESQL_UNINSTALL = ['DROP INDEX IF EXISTS %(index)s']
+
+
+def run_statements(apps, schema_editor, statements):
+    # The index is optional; without FTS5 or pg_trgm search falls back to
+    # icontains, so a failure here must not stop the migration.
+    connection = schema_editor.connection
+    params = {
+        'fts': FTS_TABLE, 'index': TRIGRAM_INDEX,
+        'table': apps.get_model('combinedchoices', 'Choice')._meta.db_table}
+    try:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    if statement == POSTGRESQL_INSTALL[1]:
+                        # CREATE INDEX IF NOT EXISTS needs PostgreSQL 9.5.
+                        cursor.execute(
+                            'SELECT 1 FROM pg_indexes WHERE indexname = %s',
+                            [TRIGRAM_INDEX])
+                        if cursor.fetchone():
+                            continue
+                    cursor.execute(statement % params)
+    except DatabaseError:
+        pass
+
+
+def forwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        run_statements(apps, schema_editor, SQLITE_INSTALL)
+    elif vendor == 'postgresql':
+        run_statements(apps, schema_editor, POSTGRESQL_INSTALL)
+
+
+def backwards(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        run_statements(apps, schema_editor, SQLITE_UNINSTALL)
+    elif vendor == 'postgresql':
+        run_statements(apps, schema_editor, POSTGRESQL_UNINSTALL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0007_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+import combinedchoices.compression
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0008_choice_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='completedcco',
+            name='form_data',
+            field=combinedchoices.compression.CompressedJSONField(default=dict),
+        ),
+    ]
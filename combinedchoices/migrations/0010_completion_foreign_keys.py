@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('combinedchoices', '0009_compressed_form_data'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='completedanswer',
+            name='choice',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.Choice', null=True),
+        ),
+        migrations.AlterField(
+            model_name='completedanswer',
+            name='section',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.Section', null=True),
+        ),
+        migrations.AlterField(
+            model_name='completedcco',
+            name='ready',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.ReadyCCO', null=True),
+        ),
+        migrations.AlterField(
+            model_name='completedcco',
+            name='snapshot',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.SET_NULL, blank=True, to='combinedchoices.ReadySnapshot', null=True),
+        ),
+        migrations.AlterField(
+            model_name='completedcco',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, blank=True, to=settings.AUTH_USER_MODEL, null=True),
+        ),
+    ]
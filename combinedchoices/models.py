@@ -1,10 +1,15 @@
+from collections import OrderedDict
 from django.apps import apps
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.shortcuts import get_object_or_404
+from django.utils.encoding import force_bytes
 from jsonfield import JSONField
+import hashlib
+
+from combinedchoices.compression import CompressedJSONField
 
 
 class UserModelManager(models.QuerySet):
@@ -39,6 +44,9 @@ class UserModelMixin(models.Model):
 
 ModelMixin = UserModelMixin
 
+# clone() default: copies stay with the owner; user=None means unowned.
+SAME_USER = object()
+
 
 class Section(ModelMixin):
     DESCRIPTION = 0  # outputed with no input
@@ -54,6 +62,7 @@ class Section(ModelMixin):
         (TEXT, 'Text'),
     )
     cross_combine = models.BooleanField(default=True)
+    lazy_choices = models.BooleanField(default=False)
     field_name = models.CharField(max_length=64, null=False, blank=False)
     field_type = models.IntegerField(
         choices=CHOICE_TYPES, null=False, blank=False)
@@ -61,6 +70,9 @@ class Section(ModelMixin):
     min_selects = models.IntegerField(null=False, default=1)
     max_selects = models.IntegerField(null=False, default=1)
 
+    class Meta:
+        unique_together = [('user', 'field_name')]
+
     def __unicode__(self):
         return '%s%s' % (self.unicode_prefex(), self.field_name)
 
@@ -68,18 +80,90 @@ class Section(ModelMixin):
     def choice_type(self):
         return self.CHOICE_TYPES[self.field_type][1]
 
+    def duplicates(self):
+        return type(self).objects.exclude(id=self.id).filter(
+            field_name=self.field_name, **self.self_kwargs())
+
     def validate_unique(self, exclude=None):
+        # (user, field_name) is enforced by the database and mapped by
+        # SectionForm.save; only sections without a user, where NULLs never
+        # collide in the unique index, still need the query here.
+        exclude = set(exclude or []) | set(['user'])
         super(Section, self).validate_unique(exclude=exclude)
-        duplicates = type(self).objects.exclude(id=self.id).filter(
-            field_name=self.field_name, **self.self_kwargs())
-        if duplicates.exists():
-            raise ValidationError(('Non-Unique Name Error'), code='invalid')
+        if ('field_name' not in exclude and self.user_id is None and
+                self.duplicates().exists()):
+            raise ValidationError({'field_name': ValidationError(
+                ('Non-Unique Name Error'), code='invalid')})
+
+
+class SectionMatrix(object):
+    """
+    Attached and available section ids per BaseCCO. rows holds one dict
+    per BaseCCO with the Section objects, for templates.
+    """
+
+    def __init__(self, baseccos, links, sections):
+        self.sections = OrderedDict(
+            (section.id, section) for section in sections)
+        self.attached = OrderedDict()
+        self.available = OrderedDict()
+        self.rows = []
+        users = {}
+        for section in self.sections.values():
+            users.setdefault(section.user_id, []).append(section.id)
+        for basecco_id, user_id, form_name in baseccos:
+            attached = links.get(basecco_id, set())
+            self.attached[basecco_id] = attached
+            self.available[basecco_id] = set(
+                users.get(user_id, [])) - attached
+            self.rows.append({
+                'id': basecco_id, 'form_name': form_name,
+                'attached': self.section_list(attached),
+                'available': self.section_list(self.available[basecco_id])})
+
+    def section_list(self, section_ids):
+        return [
+            section for section_id, section in self.sections.items()
+            if section_id in section_ids]
+
+
+class BaseCCOQuerySet(UserModelManager):
+
+    def section_matrix(self):
+        """
+        BaseCCO.available_sections for every BaseCCO in the queryset, plus
+        the attached sections, in two queries.
+        """
+        baseccos = OrderedDict()
+        links = {}
+        for basecco_id, user_id, form_name, section_id in self.order_by(
+                'id').values_list(
+                'id', 'user_id', 'form_name', 'choicesection__section_id'):
+            baseccos[basecco_id] = (basecco_id, user_id, form_name)
+            if section_id is not None:
+                links.setdefault(basecco_id, set()).add(section_id)
+        users = set(row[1] for row in baseccos.values())
+        sections = []
+        if users:
+            owners = models.Q(
+                user__in=[user_id for user_id in users if user_id is not None])
+            if None in users:
+                owners |= models.Q(user__isnull=True)
+            # Attached sections may belong to another user.
+            linked = set().union(*links.values())
+            sections = Section.objects.filter(
+                owners | models.Q(id__in=linked)).order_by('id')
+        return SectionMatrix(baseccos.values(), links, sections)
 
 
 class BaseCCO(ModelMixin):
     form_name = models.CharField(max_length=64, null=False, blank=False)
     sections = models.ManyToManyField(
         Section, through='ChoiceSection', blank=True)
+    objects = BaseCCOQuerySet.as_manager()
+
+    class Meta:
+        index_together = [('user', 'form_name')]
 
     def __unicode__(self):
         return '%s%s' % (self.unicode_prefex(), self.form_name)
@@ -92,11 +176,21 @@ class BaseCCO(ModelMixin):
         return Section.objects.filter(**self.self_kwargs()).exclude(
             basecco=self)
 
+    def clone(self, form_name=None, rename_section=None, user=SAME_USER):
+        from combinedchoices.cloning import clone_baseccos
+        form_names = {self.id: form_name} if form_name else None
+        return clone_baseccos(
+            [self], self.user if user is SAME_USER else user,
+            form_names=form_names, rename_section=rename_section)[0]
+
 
 class ChoiceSection(models.Model):
     basecco = models.ForeignKey(BaseCCO, null=False, blank=False)
     section = models.ForeignKey(Section, null=False, blank=False)
 
+    class Meta:
+        unique_together = [('basecco', 'section')]
+
     def __unicode__(self):
         return '%s - %s' % (self.basecco, self.section)
 
@@ -113,6 +207,9 @@ class ReadyCCO(ModelMixin):
     form_name = models.CharField(max_length=64, null=False, blank=False)
     included_forms = models.ManyToManyField(BaseCCO, null=False, blank=False)
 
+    class Meta:
+        index_together = [('user', 'form_name')]
+
     def __unicode__(self):
         return '%s%s' % (self.unicode_prefex(), self.form_name)
 
@@ -120,10 +217,107 @@ class ReadyCCO(ModelMixin):
     def name(self):
         return self.form_name
 
+    def clone(self, form_name=None, rename_section=None, user=SAME_USER):
+        from combinedchoices.cloning import clone_ready
+        return clone_ready(
+            self, self.user if user is SAME_USER else user,
+            form_name=form_name, rename_section=rename_section)
+
+
+class ReadySnapshot(models.Model):
+    ready = models.ForeignKey(
+        ReadyCCO, null=True, blank=True, on_delete=models.SET_NULL)
+    version = models.PositiveIntegerField(null=False, default=1)
+    content_hash = models.CharField(max_length=64, null=False)
+    schema = JSONField(default=[])
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [('ready', 'content_hash'), ('ready', 'version')]
+
+    def __unicode__(self):
+        return '%s v%s' % (self.ready, self.version)
+
 
 class CompletedCCO(ModelMixin):
     form_name = models.CharField(max_length=64, null=False, blank=False)
-    form_data = JSONField(default={})
+    form_data = CompressedJSONField(default=dict)
+    ready = models.ForeignKey(
+        ReadyCCO, null=True, blank=True, on_delete=models.SET_NULL,
+        db_constraint=False)
+    snapshot = models.ForeignKey(
+        ReadySnapshot, null=True, blank=True, on_delete=models.SET_NULL,
+        db_constraint=False)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        index_together = [('user', 'form_name')]
 
     def __unicode__(self):
         return '%s%s' % (self.unicode_prefex(), self.form_name)
+
+
+# Completions may be stored on a shard (see routers) while the users and
+# definitions they point at stay on the primary, so these foreign keys have
+# no database constraint. user comes from ModelMixin and can't be redeclared.
+CompletedCCO._meta.get_field('user').db_constraint = False
+
+
+def hash_text(text):
+    return hashlib.sha1(force_bytes(text)).hexdigest()
+
+
+def hash_texts(objs):
+    # bulk_create skips save(), so rows built for it are hashed here.
+    for obj in objs:
+        obj.text_hash = hash_text(obj.text)
+    return objs
+
+
+class TextHashMixin(object):
+
+    def save(self, *args, **kwargs):
+        self.text_hash = hash_text(self.text)
+        super(TextHashMixin, self).save(*args, **kwargs)
+
+
+class CompletedAnswerQuerySet(models.QuerySet):
+
+    def with_text(self, text):
+        return self.filter(text_hash=hash_text(text), text=text)
+
+
+class CompletedAnswer(TextHashMixin, models.Model):
+    completed = models.ForeignKey(
+        CompletedCCO, null=False, blank=False, related_name='answers')
+    field_name = models.CharField(max_length=255, null=False, db_index=True)
+    section = models.ForeignKey(
+        Section, null=True, blank=True, on_delete=models.SET_NULL,
+        db_constraint=False)
+    choice = models.ForeignKey(
+        Choice, null=True, blank=True, on_delete=models.SET_NULL,
+        db_constraint=False)
+    text = models.TextField(null=False, blank=True)
+    text_hash = models.CharField(max_length=40, null=False, db_index=True)
+    value = models.TextField(null=False, blank=True, default='')
+    objects = CompletedAnswerQuerySet.as_manager()
+
+    class Meta:
+        index_together = [('field_name', 'text_hash')]
+
+    def __unicode__(self):
+        return '%s - %s' % (self.field_name, self.text[:20])
+
+
+class ChoiceCount(TextHashMixin, models.Model):
+    ready = models.ForeignKey(ReadyCCO, null=False, blank=False)
+    field_name = models.CharField(max_length=255, null=False)
+    text = models.TextField(null=False, blank=True)
+    text_hash = models.CharField(max_length=40, null=False)
+    count = models.PositiveIntegerField(null=False, default=0)
+
+    class Meta:
+        unique_together = [('ready', 'field_name', 'text_hash')]
+
+    def __unicode__(self):
+        return '%s - %s: %s' % (self.field_name, self.text[:20], self.count)
@@ -0,0 +1,108 @@
+from django.db import connection
+from django.template.loader import select_template
+import multiprocessing
+import os
+import time
+
+from combinedchoices.exports import (
+    completed_record, iter_chunked, record_name)
+from combinedchoices.models import ReadySnapshot
+
+
+EXTENSIONS = {'html': 'html', 'text': 'txt'}
+templates = {}
+
+
+def print_rows(form_data, order=None):
+    fields = [field for field in order or [] if field in form_data]
+    fields += sorted(field for field in form_data if field not in fields)
+    rows = []
+    for field in fields:
+        value = form_data[field]
+        if isinstance(value, dict):
+            lines = ['%s: %s' % (label, value[label]) for label in value]
+        elif isinstance(value, (list, tuple)):
+            lines = list(value)
+        else:
+            lines = [value]
+        rows.append((field, lines))
+    return rows
+
+
+def layout_template(ready_id, output_format):
+    key = (ready_id, output_format)
+    if key not in templates:
+        extension = EXTENSIONS[output_format]
+        templates[key] = select_template([
+            'combinedchoices/print/ready_%s.%s' % (ready_id, extension),
+            'combinedchoices/print/completed.%s' % extension])
+    return templates[key]
+
+
+def render_record(job):
+    record, order, output_format = job
+    template = layout_template(record['ready'], output_format)
+    return record_name(record), template.render({
+        'form_name': record['form_name'], 'record': record,
+        'rows': print_rows(record['form_data'], order)})
+
+
+def iter_job_chunks(queryset, output_format, chunk_size):
+    orders = {}
+    jobs = []
+    for completed in iter_chunked(queryset, chunk_size=chunk_size):
+        record = completed_record(completed)
+        record['ready'] = completed.ready_id
+        snapshot_id = completed.snapshot_id
+        if snapshot_id not in orders:
+            orders[snapshot_id] = None
+            if snapshot_id is not None:
+                orders[snapshot_id] = [
+                    entry['name'] for entry in ReadySnapshot.objects.get(
+                        id=snapshot_id).schema]
+        jobs.append((record, orders[snapshot_id], output_format))
+        if len(jobs) == chunk_size:
+            yield jobs
+            jobs = []
+    if jobs:
+        yield jobs
+
+
+def render_completed(queryset, output_dir=None, output_file=None,
+                     output_format='html', processes=None, chunk_size=500):
+    # Records are read in this thread and only plain data crosses to the
+    # workers, which never use the database.
+    start = time.time()
+    render = map
+    pool = None
+    if processes != 1:
+        if not connection.in_atomic_block:
+            connection.close()
+        pool = multiprocessing.Pool(processes)
+        render = pool.map
+    out = open(output_file, 'wb') if output_file else None
+    count = 0
+    size = 0
+    try:
+        for jobs in iter_job_chunks(queryset, output_format, chunk_size):
+            for name, text in render(render_record, jobs):
+                data = text.encode('utf-8')
+                if out is not None:
+                    out.write(data)
+                else:
+                    path = os.path.join(output_dir, '%s.%s' % (
+                        name, EXTENSIONS[output_format]))
+                    with open(path, 'wb') as completed_file:
+                        completed_file.write(data)
+                count += 1
+                size += len(data)
+    finally:
+        if out is not None:
+            out.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    seconds = time.time() - start
+    return {
+        'count': count, 'bytes': size, 'seconds': seconds,
+        'per_second': count / seconds if seconds else 0}
@@ -0,0 +1,155 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections, transaction
+import random
+import threading
+import zlib
+
+
+DEFINITION_MODELS = ('section', 'basecco', 'choicesection', 'choice', 'readycco')
+SHARDED_MODELS = ('completedcco', 'completedanswer')
+
+state = threading.local()
+
+
+def pin_primary():
+    state.pinned = True
+
+
+def unpin(**kwargs):
+    state.pinned = False
+
+
+request_started.connect(unpin, dispatch_uid='combinedchoices_router_unpin')
+
+
+def primary_db():
+    return getattr(settings, 'COMBINEDCHOICES_PRIMARY_DB', 'default')
+
+
+def replica_dbs():
+    return getattr(settings, 'COMBINEDCHOICES_REPLICA_DBS', [])
+
+
+def shard_dbs():
+    return getattr(settings, 'COMBINEDCHOICES_SHARD_DBS', [])
+
+
+def completed_dbs():
+    return shard_dbs() or [primary_db()]
+
+
+def sharded_querysets(queryset):
+    """
+    Splits a CompletedCCO or CompletedAnswer queryset into one per shard,
+    for bulk readers that have no instance to route by. Querysets bound
+    with using(), or of other models, are returned alone.
+    """
+    model = queryset.model
+    if (queryset._db is not None or not shard_dbs() or
+            model._meta.app_label != 'combinedchoices' or
+            model._meta.model_name not in SHARDED_MODELS):
+        return [queryset]
+    return [queryset.using(alias) for alias in shard_dbs()]
+
+
+@contextmanager
+def atomic_all(aliases):
+    # Nested atomic blocks, one per distinct alias; not a two-phase commit.
+    aliases = [
+        alias for index, alias in enumerate(aliases)
+        if alias not in aliases[:index]]
+    if not aliases:
+        yield
+        return
+    with transaction.atomic(using=aliases[0]):
+        with atomic_all(aliases[1:]):
+            yield
+
+
+def shard_for_user(user_id):
+    shards = shard_dbs()
+    if not shards:
+        return primary_db()
+    # crc32 rather than hash() so every process picks the same shard.
+    return shards[zlib.crc32(('%s' % user_id).encode('utf-8')) % len(shards)]
+
+
+class CombinedChoicesRouter(object):
+    """
+    Sends definition reads to COMBINEDCHOICES_REPLICA_DBS and writes to
+    COMBINEDCHOICES_PRIMARY_DB. After a definition write, reads in the same
+    request stay on the primary. With COMBINEDCHOICES_SHARD_DBS set,
+    completions are stored on a shard chosen by user.
+    """
+
+    def model_name(self, model):
+        if model._meta.app_label != 'combinedchoices':
+            return None
+        return model._meta.model_name
+
+    def shard_hint(self, model_name, hints):
+        instance = hints.get('instance')
+        if instance is None or not shard_dbs():
+            return None
+        instance_name = self.model_name(type(instance))
+        if instance_name not in SHARDED_MODELS:
+            return None
+        if instance_name == 'completedanswer' and (
+                instance._state.db not in shard_dbs()):
+            instance = instance.completed
+        if instance._state.db in shard_dbs():
+            return instance._state.db
+        return shard_for_user(instance.user_id)
+
+    def off_shard(self, hints):
+        # Relations followed from a sharded row, e.g. completed.user, are
+        # not stored on its shard.
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in shard_dbs():
+            return primary_db()
+        return None
+
+    def db_for_read(self, model, **hints):
+        model_name = self.model_name(model)
+        if model_name in SHARDED_MODELS:
+            return self.shard_hint(model_name, hints)
+        if model_name not in DEFINITION_MODELS:
+            return self.off_shard(hints)
+        primary = primary_db()
+        replicas = replica_dbs()
+        if (not replicas or getattr(state, 'pinned', False) or
+                connections[primary].in_atomic_block):
+            return primary
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        model_name = self.model_name(model)
+        if model_name in SHARDED_MODELS:
+            return self.shard_hint(model_name, hints) or primary_db()
+        if model_name is None:
+            return self.off_shard(hints)
+        if model_name in DEFINITION_MODELS:
+            pin_primary()
+        return primary_db()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if 'combinedchoices' not in (
+                obj1._meta.app_label, obj2._meta.app_label):
+            return None
+        aliases = set([primary_db()] + replica_dbs() + shard_dbs())
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards get every table, so the foreign keys of completions can be
+        # created there; the rows they point at stay on the primary. The
+        # primary keeps empty completion tables for unhinted queries and
+        # its delete collector; signals apply deletes to the shards.
+        if db in replica_dbs():
+            return False
+        if app_label != 'combinedchoices' or not shard_dbs():
+            return None
+        return db == primary_db() or db in shard_dbs()
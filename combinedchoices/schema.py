@@ -0,0 +1,129 @@
+from collections import OrderedDict
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from combinedchoices.models import Section
+
+
+SCHEMA_KEY = 'combinedchoices:schema:%s:%s:%s'
+VERSION_KEY = 'combinedchoices:version'
+
+
+def get_cache():
+    return caches[getattr(settings, 'COMBINEDCHOICES_CACHE', 'default')]
+
+
+def definitions_version():
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seeded from the clock so an evicted counter never reuses a version.
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_definitions_version():
+    cache = get_cache()
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        return definitions_version()
+
+
+def merge_choices(choices):
+    """
+    Keeps one option per text, at its first position, using the lowest pk
+    among the choices sharing that text. Returns the (pk, text) pairs and
+    [pk, kept pk] pairs for every other pk; pairs rather than a dict, whose
+    int keys would turn into strings in JSON. Only the schema is merged;
+    each Choice row still stores its own text.
+    """
+    kept = OrderedDict()
+    for choice in choices:
+        kept.setdefault(choice.text, []).append(choice.pk)
+    merged = []
+    aliases = []
+    for text, pks in kept.items():
+        lowest = min(pks)
+        merged.append((lowest, text))
+        aliases.extend([pk, lowest] for pk in sorted(pks) if pk != lowest)
+    return merged, aliases
+
+
+def section_entry(name, section, basecco_ids, choices):
+    if section.cross_combine:
+        choices, aliases = merge_choices(choices)
+    else:
+        choices, aliases = [(choice.pk, choice.text) for choice in choices], []
+    entry = {
+        'name': name,
+        'label': name,
+        'section': section.id,
+        'baseccos': list(basecco_ids),
+        'field_type': section.field_type,
+        'cross_combine': section.cross_combine,
+        'lazy': section.lazy_choices,
+        'help_text': section.instructions,
+        'min_selects': section.min_selects,
+        'max_selects': section.max_selects,
+        'choices': choices,
+        'aliases': aliases,
+        'initial': None,
+    }
+    if section.field_type in [Section.TEXT, Section.DESCRIPTION]:
+        entry['initial'] = '\n\n'.join(
+            text for pk, text in entry['choices'])
+    elif section.field_type == Section.NUMBER:
+        entry['initial'] = '%s' % section.min_selects
+    return entry
+
+
+def compile_schema(loader, results=None):
+    # results are the rows of loader.queries(), when already fetched.
+    if results is None:
+        loader.load()
+    else:
+        loader.populate(*results)
+    return schema_entries(loader)
+
+
+def schema_entries(loader):
+    return [section_entry(*field) for field in loader.iter_fields()]
+
+
+def schema_key(ready_obj, prefix=''):
+    return SCHEMA_KEY % (prefix, ready_obj.pk, definitions_version())
+
+
+def set_schema(key, schema):
+    get_cache().set(key, schema, getattr(
+        settings, 'COMBINEDCHOICES_SCHEMA_TIMEOUT', None))
+
+
+def get_schema(ready_obj, compile, prefix=''):
+    key = schema_key(ready_obj, prefix)
+    schema = get_cache().get(key)
+    if schema is None:
+        schema = compile()
+        set_schema(key, schema)
+    return schema
+
+
+def page_choices(entry, query='', page=1, page_size=None):
+    if page_size is None:
+        page_size = lazy_page_size()
+    choices = entry['choices']
+    if query:
+        query = query.lower()
+        choices = [
+            (pk, text) for pk, text in choices
+            if text.lower().startswith(query)]
+    start = (page - 1) * page_size
+    return choices[start:start + page_size], len(choices) > start + page_size
+
+
+def lazy_page_size():
+    return getattr(settings, 'COMBINEDCHOICES_LAZY_PAGE_SIZE', 50)
@@ -0,0 +1,171 @@
+from django.db import DatabaseError, connections, transaction
+import re
+
+from combinedchoices.models import Choice
+
+
+FTS_TABLE = 'combinedchoices_choice_fts'
+TRIGRAM_INDEX = 'combinedchoices_choice_text_trgm'
+
+SQLITE_INSTALL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS %(fts)s USING fts5("
+    "text, content='%(table)s', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS %(fts)s_ai AFTER INSERT ON %(table)s BEGIN "
+    "INSERT INTO %(fts)s(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS %(fts)s_ad AFTER DELETE ON %(table)s BEGIN "
+    "INSERT INTO %(fts)s(%(fts)s, rowid, text) "
+    "VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS %(fts)s_au AFTER UPDATE OF text "
+    "ON %(table)s BEGIN "
+    "INSERT INTO %(fts)s(%(fts)s, rowid, text) "
+    "VALUES ('delete', old.id, old.text); "
+    "INSERT INTO %(fts)s(rowid, text) VALUES (new.id, new.text); END",
+    "INSERT INTO %(fts)s(%(fts)s) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS %(fts)s_ai',
+    'DROP TRIGGER IF EXISTS %(fts)s_ad',
+    'DROP TRIGGER IF EXISTS %(fts)s_au',
+    'DROP TABLE IF EXISTS %(fts)s',
+]
+POSTGRESQL_INSTALL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX %(index)s ON %(table)s USING gin (text gin_trgm_ops)',
+]
+POSTGRESQL_UNINSTALL = ['DROP INDEX IF EXISTS %(index)s']
+
+backends = {}
+
+
+def sql_params():
+    return {
+        'fts': FTS_TABLE, 'index': TRIGRAM_INDEX,
+        'table': Choice._meta.db_table}
+
+
+def run_statements(connection, statements):
+    # The index is an optimisation; a backend without FTS5 or pg_trgm keeps
+    # working with the icontains fallback.
+    try:
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement % sql_params())
+    except DatabaseError:
+        return False
+    finally:
+        backends.pop(connection.alias, None)
+    return True
+
+
+def trigram_index_exists(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_indexes WHERE indexname = %s', [TRIGRAM_INDEX])
+        return cursor.fetchone() is not None
+
+
+def install_index(connection):
+    if connection.vendor == 'sqlite':
+        return run_statements(connection, SQLITE_INSTALL)
+    if connection.vendor == 'postgresql':
+        # Checked first rather than CREATE INDEX IF NOT EXISTS, which needs
+        # PostgreSQL 9.5.
+        if trigram_index_exists(connection):
+            return run_statements(connection, POSTGRESQL_INSTALL[:1])
+        return run_statements(connection, POSTGRESQL_INSTALL)
+    return False
+
+
+def uninstall_index(connection):
+    if connection.vendor == 'sqlite':
+        return run_statements(connection, SQLITE_UNINSTALL)
+    if connection.vendor == 'postgresql':
+        return run_statements(connection, POSTGRESQL_UNINSTALL)
+    return False
+
+
+def rebuild_index(using='default'):
+    connection = connections[using]
+    if not install_index(connection):
+        return False
+    if connection.vendor == 'sqlite':
+        statement = "INSERT INTO %(fts)s(%(fts)s) VALUES ('rebuild')"
+    else:
+        statement = 'REINDEX INDEX %(index)s'
+    return run_statements(connection, [statement])
+
+
+def search_backend(using):
+    if using not in backends:
+        connection = connections[using]
+        backend = None
+        if connection.vendor == 'sqlite':
+            if FTS_TABLE in connection.introspection.table_names():
+                backend = 'fts5'
+        elif connection.vendor == 'postgresql':
+            if trigram_index_exists(connection):
+                backend = 'trigram'
+        backends[using] = backend
+    return backends[using]
+
+
+def fts_query(query):
+    # Every word is quoted, so user input never reaches FTS5 syntax, and
+    # prefixed, so partially typed words still match.
+    return ' '.join(
+        '"%s"*' % word.replace('"', '""')
+        for word in re.findall(r'\w+', query, re.UNICODE))
+
+
+def like_escape(query):
+    return query.replace('\\', '\\\\').replace('%', '\\%').replace(
+        '_', '\\_')
+
+
+def choice_queryset(user=None, basecco=None, section=None):
+    queryset = Choice.objects.all()
+    if user is not None:
+        queryset = queryset.filter(choice_section__basecco__user=user)
+    if basecco is not None:
+        queryset = queryset.filter(choice_section__basecco=basecco)
+    if section is not None:
+        queryset = queryset.filter(choice_section__section=section)
+    return queryset
+
+
+def ranked_choices(queryset, query):
+    backend = search_backend(queryset.db)
+    table = Choice._meta.db_table
+    match = fts_query(query)
+    if not match:
+        return queryset.order_by('id')
+    if backend == 'fts5':
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            select={'rank': '%s.rank' % FTS_TABLE},
+            where=['%s.rowid = %s.id' % (FTS_TABLE, table),
+                   '%s MATCH %%s' % FTS_TABLE],
+            params=[match]).order_by('rank', 'id')
+    if backend == 'trigram':
+        # ILIKE rather than icontains, whose UPPER("text") LIKE can't use
+        # the gin_trgm_ops index on text.
+        return queryset.extra(
+            select={'rank': 'similarity(%s.text, %%s)' % table},
+            select_params=[query],
+            where=['%s.text ILIKE %%s' % table],
+            params=['%%%s%%' % like_escape(query)]).order_by('-rank', 'id')
+    return queryset.filter(text__icontains=query).order_by('id')
+
+
+def search_choices(query, user=None, basecco=None, section=None, page=1,
+                   page_size=20):
+    """
+    Returns a page of choices ranked by relevance to query, and whether
+    another page follows.
+    """
+    queryset = ranked_choices(
+        choice_queryset(user=user, basecco=basecco, section=section), query)
+    start = (page - 1) * page_size
+    choices = list(queryset[start:start + page_size + 1])
+    return choices[:page_size], len(choices) > page_size
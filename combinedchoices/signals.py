@@ -0,0 +1,89 @@
+from django.core.signals import request_finished
+from django.db import connections, models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+import threading
+
+from combinedchoices.models import (
+    BaseCCO, Choice, ChoiceSection, CompletedAnswer, CompletedCCO, ReadyCCO,
+    Section)
+from combinedchoices.routers import primary_db, shard_dbs
+from combinedchoices.schema import bump_definitions_version
+
+
+DEFINITION_MODELS = (BaseCCO, Choice, ChoiceSection, ReadyCCO, Section)
+
+state = threading.local()
+
+
+def bump_at_commit(using):
+    # A request racing the transaction may compile the old rows under the
+    # version bumped before commit, so the version moves again once the
+    # change is visible. Django 1.8 has no commit hook; there the bump
+    # waits for the end of the request.
+    connection = connections[using or primary_db()]
+    if not connection.in_atomic_block:
+        return
+    on_commit = getattr(transaction, 'on_commit', None)
+    if on_commit is not None:
+        on_commit(bump_definitions_version, using=connection.alias)
+    else:
+        state.pending = True
+
+
+@receiver(request_finished, dispatch_uid='combinedchoices_pending_bump')
+def request_finished_bump(**kwargs):
+    if getattr(state, 'pending', False):
+        state.pending = False
+        bump_definitions_version()
+
+
+def definition_changed(sender, **kwargs):
+    bump_definitions_version()
+    bump_at_commit(kwargs.get('using'))
+
+
+for model in DEFINITION_MODELS:
+    post_save.connect(
+        definition_changed, sender=model,
+        dispatch_uid='combinedchoices_save_%s' % model.__name__)
+    post_delete.connect(
+        definition_changed, sender=model,
+        dispatch_uid='combinedchoices_delete_%s' % model.__name__)
+
+
+@receiver(m2m_changed, sender=ReadyCCO.included_forms.through,
+          dispatch_uid='combinedchoices_included_forms')
+def included_forms_changed(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_definitions_version()
+        bump_at_commit(kwargs.get('using'))
+
+
+# Foreign keys from sharded completions to rows on the primary. The delete
+# collector only sees the primary, so their on_delete is applied to every
+# shard here.
+SHARD_REFERENCES = [
+    (model, field) for model in (CompletedCCO, CompletedAnswer)
+    for field in model._meta.fields
+    if field.rel is not None and field.rel.to not in (
+        CompletedCCO, CompletedAnswer)]
+
+
+def referenced_deleted(sender, instance, **kwargs):
+    for alias in shard_dbs():
+        for model, field in SHARD_REFERENCES:
+            if field.rel.to is not sender:
+                continue
+            queryset = model.objects.using(alias).filter(
+                **{field.attname: instance.pk})
+            if field.rel.on_delete is models.SET_NULL:
+                queryset.update(**{field.attname: None})
+            else:
+                queryset.delete()
+
+
+for model in set(field.rel.to for model, field in SHARD_REFERENCES):
+    post_delete.connect(
+        referenced_deleted, sender=model,
+        dispatch_uid='combinedchoices_shard_delete_%s' % model.__name__)
@@ -0,0 +1,68 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+import hashlib
+import json
+
+from combinedchoices.models import ReadyCCO, ReadySnapshot
+from combinedchoices.schema import definitions_version, get_cache
+
+
+SNAPSHOT_KEY = 'combinedchoices:snapshot:%s:%s:%s'
+
+
+def schema_hash(schema):
+    return hashlib.sha256(json.dumps(
+        schema, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+
+def get_snapshot_id(ready_obj, schema):
+    content_hash = schema_hash(schema)
+    cache = get_cache()
+    key = SNAPSHOT_KEY % (
+        ready_obj.pk, definitions_version(), content_hash)
+    snapshot_id = cache.get(key)
+    if snapshot_id is not None:
+        return snapshot_id
+    snapshots = ReadySnapshot.objects.filter(ready=ready_obj)
+    snapshot_id = snapshots.filter(
+        content_hash=content_hash).values_list('id', flat=True).first()
+    if snapshot_id is None:
+        try:
+            snapshot_id = create_snapshot(ready_obj, content_hash, schema)
+        except IntegrityError:
+            snapshot_id = snapshots.get(content_hash=content_hash).id
+    cache.set(key, snapshot_id, None)
+    return snapshot_id
+
+
+def create_snapshot(ready_obj, content_hash, schema):
+    with transaction.atomic():
+        # Versions are numbered under a lock on the ReadyCCO row, so
+        # concurrent snapshots of one form queue up instead of racing.
+        list(ReadyCCO.objects.select_for_update().filter(
+            pk=ready_obj.pk).values_list('pk'))
+        snapshots = ReadySnapshot.objects.filter(ready=ready_obj)
+        snapshot_id = snapshots.filter(
+            content_hash=content_hash).values_list('id', flat=True).first()
+        if snapshot_id is not None:
+            return snapshot_id
+        latest = snapshots.aggregate(latest=Max('version'))['latest']
+        return ReadySnapshot.objects.create(
+            ready=ready_obj, content_hash=content_hash, schema=schema,
+            version=(latest or 0) + 1).id
+
+
+def diff_schemas(old, new):
+    # Compared as stored, so a live schema's tuples equal a snapshot's lists.
+    old_entries = dict(
+        (entry['name'], entry) for entry in json.loads(json.dumps(old)))
+    new_entries = dict(
+        (entry['name'], entry) for entry in json.loads(json.dumps(new)))
+    return {
+        'added': sorted(set(new_entries) - set(old_entries)),
+        'removed': sorted(set(old_entries) - set(new_entries)),
+        'changed': sorted(
+            name for name in set(old_entries) & set(new_entries)
+            if old_entries[name] != new_entries[name]),
+    }
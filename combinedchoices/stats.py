@@ -0,0 +1,93 @@
+from collections import Counter
+from django.db import IntegrityError, router, transaction
+from django.db.models import F, Q
+
+from combinedchoices.exports import iter_chunked
+from combinedchoices.models import (
+    ChoiceCount, CompletedCCO, ReadyCCO, Section, hash_text, hash_texts)
+
+
+def increment_choice_counts(ready_id, picks):
+    """
+    Adds one to the counter of every (field name, text) pick. A pick
+    repeated in picks, e.g. from a batch of completions, adds once per
+    occurrence.
+    """
+    increments = Counter(
+        (field, hash_text(text)) for field, text in picks)
+    if not increments:
+        return
+    texts = dict(((field, hash_text(text)), text) for field, text in picks)
+    using = router.db_for_write(ChoiceCount)
+    counts = ChoiceCount.objects.using(using).filter(ready_id=ready_id)
+    existing = set(counts.filter(
+        text_hash__in=set(text_hash for field, text_hash in increments),
+    ).values_list('field_name', 'text_hash'))
+    missing = [
+        ChoiceCount(ready_id=ready_id, field_name=field, text_hash=text_hash,
+                    text=texts[(field, text_hash)])
+        for field, text_hash in set(increments) - existing]
+    if missing:
+        try:
+            with transaction.atomic(using=using):
+                ChoiceCount.objects.using(using).bulk_create(missing)
+        except IntegrityError:
+            # Another completion created some of the rows concurrently.
+            for count in missing:
+                counts.get_or_create(
+                    field_name=count.field_name, text_hash=count.text_hash,
+                    defaults={'text': count.text})
+    by_amount = {}
+    for key, amount in increments.items():
+        by_amount.setdefault(amount, []).append(key)
+    for amount, keys in by_amount.items():
+        query = Q()
+        for field, text_hash in keys:
+            query |= Q(field_name=field, text_hash=text_hash)
+        counts.filter(query).update(count=F('count') + amount)
+
+
+def choice_counts(ready):
+    counts = {}
+    for field, text, count in ChoiceCount.objects.filter(
+            ready=ready).values_list('field_name', 'text', 'count'):
+        counts.setdefault(field, {})[text] = count
+    return counts
+
+
+def completed_picks(form_data, choice_fields):
+    for field, value in form_data.items():
+        if field not in choice_fields or not value:
+            continue
+        if isinstance(value, (list, tuple)):
+            for text in set(value):
+                yield field, text
+        else:
+            yield field, value
+
+
+def rebuild_choice_counts(readies=None, chunk_size=1000, form_class=None):
+    if form_class is None:
+        from combinedchoices.forms import ReadyForm as form_class
+    if readies is None:
+        readies = ReadyCCO.objects.all()
+    rebuilt = 0
+    for ready in readies.order_by('id').iterator():
+        choice_fields = set(
+            entry['name'] for entry in form_class(ready_obj=ready).schema
+            if entry['field_type'] in [Section.SINGLE, Section.MULTIPLE])
+        tally = Counter()
+        completions = CompletedCCO.objects.filter(ready=ready).only(
+            'id', 'form_data')
+        for completed in iter_chunked(completions, chunk_size=chunk_size):
+            tally.update(completed_picks(completed.form_data, choice_fields))
+        using = router.db_for_write(ChoiceCount)
+        with transaction.atomic(using=using):
+            ChoiceCount.objects.using(using).filter(ready=ready).delete()
+            ChoiceCount.objects.using(using).bulk_create(hash_texts([
+                ChoiceCount(ready=ready, field_name=field, text=text,
+                            count=count)
+                for (field, text), count in tally.items()]),
+                batch_size=chunk_size)
+        rebuilt += 1
+    return rebuilt
@@ -0,0 +1,82 @@
+import uuid
+
+STEPS_KEY = 'combinedchoices:steps:%s:%s'
+
+
+def split_steps(schema, step_size):
+    return [
+        schema[start:start + step_size]
+        for start in range(0, len(schema), step_size)] or [[]]
+
+
+def step_order(item):
+    # Step indexes are stored as strings; keep '10' after '9'.
+    step_key = item[0]
+    if step_key.isdigit():
+        return (0, int(step_key), step_key)
+    return (1, 0, step_key)
+
+
+def new_token():
+    return uuid.uuid4().hex
+
+
+class SessionStepStorage(object):
+    """
+    Keeps the cleaned answers of finished steps of a ReadyForm in the
+    session until the final step saves the CompletedCCO. Pass a token
+    (see new_token) carried between the steps to keep concurrent fills of
+    one ReadyCCO, e.g. in two tabs, apart.
+    """
+
+    def __init__(self, session, ready_obj, token=''):
+        self.session = session
+        self.key = STEPS_KEY % (ready_obj.pk, token)
+
+    def load(self):
+        return self.session.get(self.key, {})
+
+    def current(self, version=None):
+        # Steps saved against another schema version are dropped.
+        steps = self.load()
+        if version is None:
+            return steps
+        fresh = dict(
+            (step_key, step) for step_key, step in steps.items()
+            if step.get('version') == version)
+        if len(fresh) != len(steps):
+            self.session[self.key] = fresh
+            self.session.modified = True
+        return fresh
+
+    def save_step(self, step_key, completed, answers, names=(),
+                  version=None):
+        steps = self.current(version)
+        steps['%s' % step_key] = {
+            'completed': completed, 'answers': [list(a) for a in answers],
+            'names': list(names), 'version': version}
+        self.session[self.key] = steps
+        self.session.modified = True
+
+    def saved_names(self, exclude=None, version=None):
+        names = set()
+        for step_key, step in self.current(version).items():
+            if step_key != exclude:
+                names.update(step.get('names', []))
+        return names
+
+    def merge(self, completed, answers, exclude=None, version=None):
+        merged = {}
+        merged_answers = []
+        for step_key, step in sorted(
+                self.current(version).items(), key=step_order):
+            if step_key == exclude:
+                continue
+            merged.update(step['completed'])
+            merged_answers.extend(tuple(answer) for answer in step['answers'])
+        merged.update(completed)
+        return merged, merged_answers + list(answers)
+
+    def clear(self):
+        if self.key in self.session:
+            del self.session[self.key]
@@ -0,0 +1,131 @@
+from django.db import DatabaseError, router, transaction
+from django.db.models import Max
+
+from combinedchoices.forms import ReadyForm
+from combinedchoices.instrumentation import measure
+from combinedchoices.models import ChoiceCount, CompletedAnswer, CompletedCCO
+from combinedchoices.routers import atomic_all, completed_dbs
+from combinedchoices.stats import increment_choice_counts
+
+
+def bulk_create_completions(using, completions, need_ids=False):
+    """
+    Inserts completions in one query. Returns False, with the insert
+    rolled back, when their ids were needed and can't be told apart from
+    rows another writer added meanwhile.
+    """
+    if not need_ids:
+        CompletedCCO.objects.using(using).bulk_create(completions)
+        return True
+    last_id = CompletedCCO.objects.using(using).aggregate(
+        last=Max('id'))['last']
+    savepoint = transaction.savepoint(using=using)
+    CompletedCCO.objects.using(using).bulk_create(completions)
+    if not all(completion.pk is not None for completion in completions):
+        # Backends that do not return ids number the batch after last_id
+        # unless another writer committed into the range.
+        ids = list(CompletedCCO.objects.using(using).filter(
+            id__gt=last_id or 0).order_by('id').values_list('id', flat=True))
+        if len(ids) != len(completions):
+            transaction.savepoint_rollback(savepoint, using=using)
+            return False
+        for completion, pk in zip(completions, ids):
+            completion.pk = pk
+    transaction.savepoint_commit(savepoint, using=using)
+    return True
+
+
+def create_each(using, shard):
+    # Row by row, so every id is known and a failure stays with its item.
+    created = []
+    failures = {}
+    for position, form, completion, form_answers in shard:
+        try:
+            with transaction.atomic(using=using):
+                completion.save(force_insert=True, using=using)
+        except DatabaseError as error:
+            completion.pk = None
+            failures[position] = {'__all__': ['%s' % error]}
+        else:
+            created.append((position, form, completion, form_answers))
+    return created, failures
+
+
+def save_batch(forms):
+    """
+    Creates the completions of validated forms. Returns the created
+    CompletedCCOs and the errors of forms that could not be saved, by
+    their position in forms.
+    """
+    first = forms[0]
+    with measure('save', lambda: {
+            'ready_id': first.ready_obj.pk, 'completions': len(forms)}):
+        store_answers = first.get_option(
+            'store_answers', 'COMBINEDCHOICES_STORE_ANSWERS')
+        shards = {}
+        for position, form in enumerate(forms):
+            name, completed, form_answers = form.completed_data()
+            completion = CompletedCCO(
+                form_name=name, form_data=completed,
+                **form.completed_kwargs())
+            shards.setdefault(router.db_for_write(
+                CompletedCCO, instance=completion), []).append(
+                (position, form, completion, form_answers))
+        created = []
+        failures = {}
+        for using, shard in shards.items():
+            if not bulk_create_completions(
+                    using, [completion for _, _, completion, _ in shard],
+                    need_ids=store_answers):
+                shard, shard_failures = create_each(using, shard)
+                failures.update(shard_failures)
+            created.extend(shard)
+            if store_answers:
+                rows = []
+                for position, form, completion, form_answers in shard:
+                    rows.extend(form.answer_rows(completion, form_answers))
+                CompletedAnswer.objects.using(using).bulk_create(rows)
+        if first.get_option('count_choices', 'COMBINEDCHOICES_COUNT_CHOICES'):
+            picks = []
+            for position, form, completion, form_answers in created:
+                picks.extend(form.choice_picks(form_answers))
+            increment_choice_counts(first.ready_obj.pk, picks)
+    created.sort(key=lambda item: item[0])
+    return [item[2] for item in created], failures
+
+
+def submit_many(ready_obj, payloads, form_class=ReadyForm, batch_size=500):
+    """
+    Validates every payload against one compiled schema and inserts the
+    valid ones in batches. Returns the number created and the errors of
+    each rejected payload by its index.
+    """
+    schema = form_class(ready_obj=ready_obj).schema
+    errors = {}
+    created = 0
+    pending = []
+    indexes = []
+
+    def flush():
+        completions, failures = save_batch(pending)
+        for position, error in failures.items():
+            errors[indexes[position]] = error
+        return len(completions)
+
+    with atomic_all(completed_dbs() + [router.db_for_write(ChoiceCount)]):
+        for index, data in enumerate(payloads):
+            form = form_class(data, ready_obj=ready_obj, schema=schema)
+            if not form.is_valid():
+                errors[index] = dict(
+                    (field, list(messages))
+                    for field, messages in form.errors.items())
+                continue
+            pending.append(form)
+            indexes.append(index)
+            if len(pending) == batch_size:
+                created += flush()
+                pending = []
+                indexes = []
+        if pending:
+            created += flush()
+    return {'created': created, 'errors': errors}
@@ -1,14 +1,55 @@
 from django.apps import apps
+from django.contrib import admin
 from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core import serializers
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.signals import request_finished
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.loader import MigrationLoader
 from django.http import Http404
-from django.test import TestCase
+from django.test import (
+    RequestFactory, TestCase, TransactionTestCase, override_settings)
+from django.utils import timezone
+from django.utils.six import StringIO
 from model_mommy import mommy
+from unittest import skipIf
+import json
+import logging
+import os
+import tempfile
 
+from combinedchoices import instrumentation, search
+from combinedchoices.admin import EstimatedCountPaginator, estimated_count
+from combinedchoices.benchmarks import PHASES, make_dataset, run_benchmark
+from combinedchoices.compression import RawJSON, convert_form_data
+from combinedchoices.exports import flatten_form_data, iter_records
 from combinedchoices.forms import (
-    mNumberWidget, MultiNumberField, ReadyForm)
+    mNumberWidget, MultiNumberField, ReadyForm, SectionForm)
+from combinedchoices.importers import import_definition
+from combinedchoices.management.filters import parse_moment
 from combinedchoices.models import (
-    BaseCCO, Choice, ChoiceSection, CompletedCCO, ReadyCCO, Section)
+    BaseCCO, Choice, ChoiceSection, CompletedAnswer, CompletedCCO, ReadyCCO,
+    ReadySnapshot, Section)
+from combinedchoices.printing import print_rows, render_completed
+from combinedchoices.routers import CombinedChoicesRouter, pin_primary, unpin
+from combinedchoices.schema import (
+    definitions_version, get_cache, merge_choices)
+from combinedchoices.snapshots import diff_schemas, get_snapshot_id
+from combinedchoices.stats import choice_counts, rebuild_choice_counts
+from combinedchoices.steps import SessionStepStorage, new_token
+from combinedchoices.submissions import submit_many
+from combinedchoices.views import choice_page, choice_search, ready_schema
+
+try:
+    from combinedchoices import aio
+except (ImportError, SyntaxError):
+    # The coroutines need Python 3.5+.
+    aio = None
 
 
 class Unicode_Tests(TestCase):
@@ -292,3 +333,1798 @@ class Section_Type_by_Form_Tests(TestCase):
         self.assertEqual(
             CompletedCCO.objects.get().form_data['section'],
             {u'test_choice': u'5'})
+
+
+class ReadyLoader_Tests(TestCase):
+
+    def make_ready(self, forms, sections):
+        user = mommy.make(User)
+        baseccos = [
+            mommy.make(BaseCCO, form_name='form%s' % count, user=user)
+            for count in range(forms)]
+        for count in range(sections):
+            sect = mommy.make(
+                Section, field_name='section%s' % count, user=user,
+                cross_combine=bool(count % 2),
+                field_type=count % len(Section.CHOICE_TYPES))
+            for basecco in baseccos:
+                cs = mommy.make(ChoiceSection, basecco=basecco, section=sect)
+                mommy.make(Choice, choice_section=cs, _quantity=3)
+        return mommy.make(ReadyCCO, user=user, included_forms=baseccos)
+
+    def test_constant_queries(self):
+        combined = self.make_ready(2, 4)
+        with self.assertNumQueries(3):
+            small = ReadyForm(ready_obj=combined)
+        combined = self.make_ready(6, 10)
+        with self.assertNumQueries(3):
+            large = ReadyForm(ready_obj=combined)
+        self.assertEqual(len(small.fields), 1 + 2 + 2 * 2)
+        self.assertEqual(len(large.fields), 1 + 5 + 5 * 6)
+
+    def test_layout(self):
+        user = mommy.make(User, username='testuser')
+        comp1 = mommy.make(BaseCCO, form_name='comp1', user=user)
+        comp2 = mommy.make(BaseCCO, form_name='comp2', user=user)
+        cross = mommy.make(
+            Section, field_name='cross', cross_combine=True, user=user,
+            field_type=Section.MULTIPLE)
+        uncross = mommy.make(
+            Section, field_name='uncross', cross_combine=False, user=user,
+            field_type=Section.TEXT)
+        for comp, text in ((comp1, 'b'), (comp2, 'a')):
+            cs = mommy.make(ChoiceSection, basecco=comp, section=cross)
+            mommy.make(Choice, choice_section=cs, text=text)
+            cs = mommy.make(ChoiceSection, basecco=comp, section=uncross)
+            mommy.make(Choice, choice_section=cs, text=comp.form_name)
+        combined = mommy.make(
+            ReadyCCO, user=user, included_forms=[comp1, comp2])
+        form = ReadyForm(ready_obj=combined)
+        self.assertEqual(
+            [label for value, label in form.fields['cross'].widget.choices],
+            ['a', 'b'])
+        self.assertEqual(form.fields['comp1 - uncross'].initial, 'comp1')
+        self.assertEqual(form.fields['comp2 - uncross'].initial, 'comp2')
+
+
+class Schema_Cache_Tests(TestCase):
+
+    def setUp(self):
+        self.comp = mommy.make(BaseCCO, form_name='comp')
+        self.sect = mommy.make(
+            Section, field_name='section', field_type=Section.MULTIPLE)
+        self.cs = mommy.make(
+            ChoiceSection, basecco=self.comp, section=self.sect)
+        mommy.make(Choice, choice_section=self.cs, text='first')
+        self.combined = mommy.make(ReadyCCO, included_forms=[self.comp])
+
+    def choice_labels(self):
+        form = ReadyForm(ready_obj=self.combined)
+        return [label for value, label in form.fields['section'].widget.choices]
+
+    def test_cached_build(self):
+        ReadyForm(ready_obj=self.combined)
+        with self.assertNumQueries(0):
+            form = ReadyForm(ready_obj=self.combined)
+        self.assertEqual(
+            form.schema[0]['choices'][0][1], 'first')
+
+    def test_choice_invalidates(self):
+        self.assertEqual(self.choice_labels(), ['first'])
+        choice = mommy.make(Choice, choice_section=self.cs, text='second')
+        self.assertEqual(self.choice_labels(), ['first', 'second'])
+        choice.delete()
+        self.assertEqual(self.choice_labels(), ['first'])
+
+    def test_section_invalidates(self):
+        ReadyForm(ready_obj=self.combined)
+        self.sect.field_type = Section.TEXT
+        self.sect.save()
+        form = ReadyForm(ready_obj=self.combined)
+        self.assertEqual(form.fields['section'].initial, 'first')
+
+    @skipIf(hasattr(transaction, 'on_commit'), 'bumped by on_commit')
+    def test_bumped_again_after_request(self):
+        self.sect.save()
+        version = definitions_version()
+        request_finished.send(sender=None)
+        self.assertGreater(definitions_version(), version)
+        version = definitions_version()
+        request_finished.send(sender=None)
+        self.assertEqual(definitions_version(), version)
+
+    def test_included_forms_invalidates(self):
+        ReadyForm(ready_obj=self.combined)
+        self.combined.included_forms.remove(self.comp)
+        form = ReadyForm(ready_obj=self.combined)
+        self.assertEqual(list(form.fields.keys()), ['form_name'])
+
+
+class Preloaded_Validation_Tests(TestCase):
+
+    def setUp(self):
+        comp = mommy.make(BaseCCO, form_name='comp')
+        self.choices = {}
+        for field_type in (Section.SINGLE, Section.MULTIPLE):
+            for count in range(5):
+                sect = mommy.make(
+                    Section, field_name='%s-%s' % (field_type, count),
+                    field_type=field_type)
+                cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+                self.choices[sect.field_name] = mommy.make(
+                    Choice, choice_section=cs, _quantity=3)
+        self.combined = mommy.make(ReadyCCO, included_forms=[comp])
+        ReadyForm(ready_obj=self.combined)
+
+    def post_data(self):
+        data = {'form_name': 'completed'}
+        for name, choices in self.choices.items():
+            if name.startswith('%s' % Section.SINGLE):
+                data[name] = choices[0].pk
+            else:
+                data[name] = [choice.pk for choice in choices[1:]]
+        return data
+
+    def test_validate_and_save_queries(self):
+        with self.assertNumQueries(0):
+            form = ReadyForm(self.post_data(), ready_obj=self.combined)
+            self.assertTrue(form.is_valid())
+        with self.assertNumQueries(1):
+            completed = form.save()
+        for name, choices in self.choices.items():
+            if name.startswith('%s' % Section.SINGLE):
+                self.assertEqual(completed.form_data[name], choices[0].text)
+            else:
+                self.assertEqual(
+                    completed.form_data[name],
+                    sorted(choice.text for choice in choices[1:]))
+
+    def test_invalid_choice(self):
+        other = mommy.make(Choice)
+        data = self.post_data()
+        data['%s-0' % Section.SINGLE] = other.pk
+        data['%s-0' % Section.MULTIPLE] = [other.pk]
+        data['%s-1' % Section.MULTIPLE] = ['text']
+        form = ReadyForm(data, ready_obj=self.combined)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(
+            sorted(form.errors.keys()), sorted([
+                '%s-0' % Section.SINGLE, '%s-0' % Section.MULTIPLE,
+                '%s-1' % Section.MULTIPLE]))
+
+    def test_queryset_mode(self):
+        form_class = type(
+            'QuerysetReadyForm', (ReadyForm,), {'validate_in_memory': False})
+        queryset_form = form_class(self.post_data(), ready_obj=self.combined)
+        self.assertTrue(queryset_form.is_valid())
+        form = ReadyForm(self.post_data(), ready_obj=self.combined)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(
+            queryset_form.save().form_data, form.save().form_data)
+
+
+class Benchmark_Tests(TestCase):
+
+    def test_query_counts(self):
+        small = make_dataset(baseccos=2, sections_per_type=1, prefix='small')
+        large = make_dataset(baseccos=8, sections_per_type=4, prefix='large')
+        for ready in small + large:
+            results = run_benchmark(ready)
+            self.assertEqual(
+                [results[phase]['queries'] for phase in PHASES],
+                [3, 0, 0, 0, 1])
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            'combinedchoices_benchmark', baseccos=2, sections_per_type=1,
+            stdout=out)
+        self.assertTrue('build_cached' in out.getvalue())
+        self.assertFalse(ReadyCCO.objects.exists())
+
+
+class Export_Tests(TestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User, username='exporter')
+        for count in range(5):
+            CompletedCCO.objects.create(
+                user=self.user, form_name='form%s' % (count % 2),
+                form_data={'text': 'value %s' % count, 'multi': ['a', 'b'],
+                           'number': {'x': '1'}})
+        CompletedCCO.objects.create(form_name='form0', form_data={})
+
+    def test_iter_records_chunked(self):
+        with self.assertNumQueries(3):
+            records = list(iter_records(chunk_size=2, user=self.user))
+        self.assertEqual(len(records), 5)
+        self.assertEqual(
+            [record['id'] for record in records],
+            sorted(record['id'] for record in records))
+
+    def test_filters(self):
+        self.assertEqual(
+            len(list(iter_records(form_name='form0'))), 4)
+        self.assertEqual(
+            len(list(iter_records(user=self.user, form_name='form0'))), 3)
+        self.assertEqual(len(list(iter_records(since=timezone.now()))), 0)
+        self.assertEqual(len(list(iter_records(until=timezone.now()))), 6)
+
+    def test_flatten(self):
+        self.assertEqual(
+            flatten_form_data({'multi': ['a', 'b'], 'number': {'x': '1'}}),
+            {'multi': 'a; b', 'number: x': '1'})
+
+    def test_command_jsonl(self):
+        out = StringIO()
+        call_command(
+            'combinedchoices_export', user='exporter', stdout=out,
+            stderr=StringIO())
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['form_data']['text'], 'value 0')
+
+    def test_command_csv(self):
+        out = StringIO()
+        call_command(
+            'combinedchoices_export', format='csv', form_name='form1',
+            stdout=out, stderr=StringIO())
+        lines = out.getvalue().splitlines()
+        self.assertEqual(
+            lines[0], 'id,user,form_name,created,multi,number: x,text')
+        self.assertEqual(len(lines), 3)
+
+    def test_parse_moment(self):
+        with self.settings(USE_TZ=True):
+            self.assertTrue(timezone.is_aware(parse_moment('2016-01-02')))
+        with self.settings(USE_TZ=False):
+            self.assertTrue(timezone.is_naive(parse_moment('2016-01-02')))
+
+
+class Import_Tests(TestCase):
+
+    def definition(self):
+        return {
+            'sections': [
+                {'field_name': 'single', 'field_type': 'single'},
+                {'field_name': 'text', 'field_type': Section.TEXT,
+                 'cross_combine': False},
+            ],
+            'baseccos': [
+                {'form_name': 'first', 'sections': {
+                    'single': ['a', 'b'], 'text': ['first text']}},
+                {'form_name': 'second', 'sections': {
+                    'single': ['c'], 'text': ['second text']}},
+            ],
+        }
+
+    def test_import(self):
+        user = mommy.make(User)
+        with self.assertNumQueries(11):
+            counts = import_definition(self.definition(), user=user)
+        self.assertEqual(counts, {
+            'sections': 2, 'baseccos': 2, 'choice_sections': 4,
+            'choices': 5})
+        first = BaseCCO.objects.get(form_name='first')
+        self.assertEqual(first.user, user)
+        self.assertEqual(
+            sorted(Choice.objects.filter(
+                choice_section__basecco=first,
+                choice_section__section__field_name='single',
+            ).values_list('text', flat=True)), ['a', 'b'])
+        self.assertEqual(
+            Section.objects.get(field_name='single').field_type,
+            Section.SINGLE)
+
+    def test_duplicate_section(self):
+        user = mommy.make(User)
+        mommy.make(Section, field_name='single', user=user)
+        self.assertRaises(
+            ValidationError, import_definition, self.definition(), user=user)
+        self.assertFalse(BaseCCO.objects.exists())
+        definition = self.definition()
+        definition['sections'].append({
+            'field_name': 'text', 'field_type': 'text'})
+        self.assertRaises(ValidationError, import_definition, definition)
+
+    def test_unknown_section(self):
+        definition = self.definition()
+        definition['baseccos'][0]['sections']['missing'] = ['x']
+        self.assertRaises(ValidationError, import_definition, definition)
+        self.assertFalse(Section.objects.exists())
+
+    def test_unknown_key(self):
+        definition = self.definition()
+        definition['sections'][0]['colour'] = 'red'
+        self.assertRaises(ValidationError, import_definition, definition)
+        path = os.path.join(tempfile.mkdtemp(), 'library.json')
+        with open(path, 'w') as library:
+            json.dump(definition, library)
+        with self.assertRaisesRegexp(CommandError, 'colour'):
+            call_command('combinedchoices_import', path, stdout=StringIO())
+
+    def test_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'library.json')
+        with open(path, 'w') as library:
+            json.dump(self.definition(), library)
+        out = StringIO()
+        call_command('combinedchoices_import', path, stdout=out)
+        self.assertTrue('5 choices' in out.getvalue())
+        self.assertEqual(Choice.objects.count(), 5)
+
+
+class CompletedAnswer_Tests(TestCase):
+
+    def setUp(self):
+        comp = mommy.make(BaseCCO, form_name='comp')
+        self.choices = {}
+        for field_type in (Section.SINGLE, Section.MULTIPLE, Section.NUMBER,
+                           Section.TEXT):
+            sect = mommy.make(
+                Section, field_name='%s' % field_type, field_type=field_type)
+            cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+            self.choices[field_type] = [
+                mommy.make(Choice, choice_section=cs, text=text)
+                for text in ('x', 'y')]
+        self.combined = mommy.make(ReadyCCO, included_forms=[comp])
+        self.data = {
+            'form_name': 'done',
+            '%s' % Section.SINGLE: self.choices[Section.SINGLE][0].pk,
+            '%s' % Section.MULTIPLE: [
+                choice.pk for choice in self.choices[Section.MULTIPLE]],
+            '%s_0' % Section.NUMBER: '3', '%s_1' % Section.NUMBER: '4',
+            '%s' % Section.TEXT: 'typed',
+        }
+
+    def test_disabled_by_default(self):
+        form = ReadyForm(self.data, ready_obj=self.combined)
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertFalse(CompletedAnswer.objects.exists())
+
+    def test_store_answers(self):
+        form_class = type(
+            'AnswerReadyForm', (ReadyForm,), {'store_answers': True})
+        form = form_class(self.data, ready_obj=self.combined)
+        self.assertTrue(form.is_valid())
+        completed = form.save()
+        self.assertEqual(completed.answers.count(), 6)
+        single = completed.answers.get(field_name='%s' % Section.SINGLE)
+        self.assertEqual(single.choice, self.choices[Section.SINGLE][0])
+        self.assertEqual(single.section.field_type, Section.SINGLE)
+        self.assertEqual(
+            CompletedAnswer.objects.with_text('y').filter(
+                field_name='%s' % Section.MULTIPLE).count(), 1)
+        self.assertEqual(
+            completed.answers.get(
+                field_name='%s' % Section.NUMBER, text='y').value, '4')
+        self.assertEqual(
+            completed.answers.get(field_name='%s' % Section.TEXT).text,
+            'typed')
+
+    def test_text_hash_follows_text(self):
+        answer = CompletedAnswer(
+            completed=mommy.make(CompletedCCO), field_name='f', text='old')
+        answer.text = 'new'
+        answer.save()
+        self.assertEqual(CompletedAnswer.objects.with_text('new').get(), answer)
+        answer = CompletedAnswer(
+            completed=answer.completed, field_name='f', text='x',
+            value='9' * 100)
+        answer.save()
+        self.assertEqual(
+            CompletedAnswer.objects.get(pk=answer.pk).value, '9' * 100)
+
+
+class ChoiceCount_Tests(TestCase):
+
+    def setUp(self):
+        comp = mommy.make(BaseCCO, form_name='comp')
+        self.choices = {}
+        for field_type in (Section.SINGLE, Section.MULTIPLE, Section.TEXT):
+            sect = mommy.make(
+                Section, field_name='%s' % field_type, field_type=field_type)
+            cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+            self.choices[field_type] = [
+                mommy.make(Choice, choice_section=cs, text=text)
+                for text in ('x', 'y')]
+        self.combined = mommy.make(ReadyCCO, included_forms=[comp])
+        self.form_class = type(
+            'CountReadyForm', (ReadyForm,), {'count_choices': True})
+
+    def submit(self, single, multiple, form_class=None):
+        form = (form_class or self.form_class)({
+            'form_name': 'done', '%s' % Section.TEXT: 'typed',
+            '%s' % Section.SINGLE: self.choices[Section.SINGLE][single].pk,
+            '%s' % Section.MULTIPLE: [
+                self.choices[Section.MULTIPLE][index].pk
+                for index in multiple],
+        }, ready_obj=self.combined)
+        self.assertTrue(form.is_valid())
+        return form.save()
+
+    def expected(self):
+        return {
+            '%s' % Section.SINGLE: {'x': 2, 'y': 1},
+            '%s' % Section.MULTIPLE: {'x': 3, 'y': 1},
+        }
+
+    def test_incremental(self):
+        self.submit(0, [0, 1])
+        self.submit(1, [0])
+        completed = self.submit(0, [0])
+        self.assertEqual(completed.ready, self.combined)
+        self.assertEqual(choice_counts(self.combined), self.expected())
+
+    def test_rebuild(self):
+        for single, multiple in ((0, [0, 1]), (1, [0]), (0, [0])):
+            self.submit(single, multiple, form_class=ReadyForm)
+        self.assertEqual(choice_counts(self.combined), {})
+        out = StringIO()
+        call_command(
+            'combinedchoices_rebuild_counts', ready=[self.combined.id],
+            chunk_size=2, stdout=out)
+        self.assertEqual(choice_counts(self.combined), self.expected())
+        self.submit(1, [1])
+        rebuild_choice_counts(ReadyCCO.objects.all())
+        self.assertEqual(
+            choice_counts(self.combined)['%s' % Section.SINGLE],
+            {'x': 2, 'y': 2})
+
+
+class Instrumentation_Tests(TestCase):
+
+    def setUp(self):
+        comp = mommy.make(BaseCCO, form_name='comp')
+        for field_type in (Section.SINGLE, Section.TEXT):
+            sect = mommy.make(
+                Section, field_name='%s' % field_type, field_type=field_type)
+            cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+            choice = mommy.make(Choice, choice_section=cs, text='x')
+            if field_type == Section.SINGLE:
+                self.choice = choice
+        self.combined = mommy.make(ReadyCCO, included_forms=[comp])
+
+    def test_disabled(self):
+        self.assertEqual(
+            instrumentation.measure('build'),
+            instrumentation.NULL_MEASUREMENT)
+
+    def test_phases(self):
+        with instrumentation.MemoryCollector() as collector:
+            ReadyForm(ready_obj=self.combined)
+            form = ReadyForm({
+                'form_name': 'done', '%s' % Section.SINGLE: self.choice.pk,
+            }, ready_obj=self.combined)
+            form.as_p()
+            self.assertTrue(form.is_valid())
+            form.save()
+        self.assertEqual(instrumentation.collectors, [])
+        builds = collector.phase('build')
+        self.assertEqual(len(builds), 2)
+        self.assertEqual(builds[0].queries, 3)
+        self.assertEqual(builds[1].queries, 0)
+        self.assertEqual(builds[0].info, {
+            'ready_id': self.combined.pk, 'sections': 2, 'choices': 2})
+        self.assertEqual(len(collector.phase('compile')), 1)
+        self.assertEqual(
+            sorted(event.info['field'] for event in collector.phase('field')),
+            sorted(['%s' % Section.SINGLE, '%s' % Section.TEXT] * 2))
+        self.assertEqual(len(collector.phase('render')), 1)
+        self.assertEqual(len(collector.phase('clean')), 1)
+        self.assertEqual(collector.phase('save')[0].queries, 1)
+        fields = sorted(['form_name', '%s' % Section.SINGLE,
+                         '%s' % Section.TEXT])
+        for phase in ('render_field', 'clean_field'):
+            self.assertEqual(sorted(
+                event.info['field'] for event in collector.phase(phase)),
+                fields)
+        self.assertEqual(
+            [event.info.get('section_id')
+             for event in collector.phase('clean_field')
+             if event.info['field'] == '%s' % Section.SINGLE],
+            [form.field_sections['%s' % Section.SINGLE]])
+
+    def test_nested_query_counts(self):
+        with instrumentation.MemoryCollector() as collector:
+            with instrumentation.measure('outer'):
+                list(BaseCCO.objects.all())
+                with instrumentation.measure('inner'):
+                    list(Section.objects.all())
+        self.assertEqual(collector.phase('outer')[0].queries, 2)
+        self.assertEqual(collector.phase('inner')[0].queries, 1)
+        for name in instrumentation.CURSOR_FACTORIES:
+            self.assertNotIn(name, vars(connections['default']))
+
+    def test_field_clean_restored(self):
+        form = ReadyForm({'form_name': 'x'}, ready_obj=mommy.make(ReadyCCO))
+        with instrumentation.MemoryCollector() as collector:
+            self.assertTrue(form.is_valid())
+        self.assertEqual(len(collector.phase('clean_field')), 1)
+        self.assertNotIn('clean', vars(form.fields['form_name']))
+
+    def test_logging_collector(self):
+        collector = instrumentation.LoggingCollector(level=logging.INFO)
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        collector.logger.addHandler(handler)
+        collector.logger.setLevel(logging.INFO)
+        try:
+            collector(instrumentation.Event('build', 0.5, 3, ready_id=1))
+        finally:
+            collector.logger.removeHandler(handler)
+            collector.logger.setLevel(logging.NOTSET)
+        self.assertTrue(
+            records[0].getMessage().startswith('build took 0.5000s'))
+
+
+@override_settings(
+    ROOT_URLCONF='combinedchoices.urls', COMBINEDCHOICES_LAZY_PAGE_SIZE=2)
+class LazyChoices_Tests(TestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User)
+        comp = mommy.make(BaseCCO, form_name='comp', user=self.user)
+        sect = mommy.make(
+            Section, field_name='big', field_type=Section.MULTIPLE,
+            lazy_choices=True, user=self.user)
+        cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+        self.choices = [
+            mommy.make(Choice, choice_section=cs, text=text)
+            for text in ('apple', 'apricot', 'banana', 'blueberry', 'cherry')]
+        self.combined = mommy.make(
+            ReadyCCO, included_forms=[comp], user=self.user)
+
+    def test_first_page(self):
+        form = ReadyForm(ready_obj=self.combined)
+        widget = form.fields['big'].widget
+        self.assertEqual(
+            [text for pk, text in widget.choices], ['apple', 'apricot'])
+        self.assertEqual(
+            widget.attrs['data-lazy-url'],
+            reverse('combinedchoices-choices', args=[self.combined.pk]))
+
+    def test_selected_rendered_and_valid(self):
+        form = ReadyForm({
+            'form_name': 'done', 'big': [self.choices[4].pk],
+        }, ready_obj=self.combined)
+        self.assertEqual(
+            [text for pk, text in form.fields['big'].widget.choices],
+            ['apple', 'apricot', 'cherry'])
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.save().form_data['big'], ['cherry'])
+
+    def request(self, **params):
+        request = RequestFactory().get('/', params)
+        request.user = self.user
+        return choice_page(request, ready_id='%s' % self.combined.pk)
+
+    def test_view_pages(self):
+        data = json.loads(self.request(field='big', page=2).content)
+        self.assertEqual(
+            [result['text'] for result in data['results']],
+            ['banana', 'blueberry'])
+        self.assertTrue(data['has_next'])
+        data = json.loads(self.request(field='big', q='B').content)
+        self.assertEqual(
+            [result['id'] for result in data['results']],
+            [self.choices[2].pk, self.choices[3].pk])
+        self.assertFalse(data['has_next'])
+
+    def test_view_unknown_field(self):
+        self.assertRaises(Http404, self.request, field='missing')
+
+
+class Snapshot_Tests(TestCase):
+
+    def setUp(self):
+        comp = mommy.make(BaseCCO, form_name='comp')
+        self.sect = mommy.make(
+            Section, field_name='single', field_type=Section.SINGLE)
+        self.cs = mommy.make(ChoiceSection, basecco=comp, section=self.sect)
+        self.choice = mommy.make(Choice, choice_section=self.cs, text='x')
+        self.combined = mommy.make(ReadyCCO, included_forms=[comp])
+        self.form_class = type(
+            'SnapshotReadyForm', (ReadyForm,), {'snapshot': True})
+
+    def submit(self):
+        form = self.form_class({
+            'form_name': 'done', 'single': self.choice.pk,
+        }, ready_obj=self.combined)
+        self.assertTrue(form.is_valid())
+        return form.save()
+
+    def test_shared_snapshot(self):
+        first = self.submit()
+        with self.assertNumQueries(1):
+            second = self.submit()
+        self.assertEqual(first.snapshot, second.snapshot)
+        self.assertEqual(first.snapshot.version, 1)
+        self.assertEqual(
+            first.snapshot.schema[0]['choices'], [[self.choice.pk, 'x']])
+
+    def test_new_version(self):
+        first = self.submit()
+        mommy.make(Choice, choice_section=self.cs, text='y')
+        second = self.submit()
+        self.assertNotEqual(first.snapshot, second.snapshot)
+        self.assertEqual(second.snapshot.version, 2)
+        self.assertEqual(
+            diff_schemas(first.snapshot.schema, second.snapshot.schema),
+            {'added': [], 'removed': [], 'changed': ['single']})
+
+    def test_version_unique(self):
+        snapshot = self.submit().snapshot
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ReadySnapshot.objects.create(
+                ready=self.combined, content_hash='other', version=1)
+        self.assertEqual(
+            get_snapshot_id(self.combined, [{'name': 'other'}]),
+            ReadySnapshot.objects.get(version=2).id)
+        self.assertNotEqual(snapshot.id, ReadySnapshot.objects.get(version=2).id)
+
+    def test_reprint_from_snapshot(self):
+        completed = self.submit()
+        self.sect.field_name = 'renamed'
+        self.sect.save()
+        schema = completed.snapshot.schema
+        with self.assertNumQueries(0):
+            form = ReadyForm(ready_obj=self.combined, schema=schema)
+        self.assertTrue('single' in form.fields)
+
+
+class Printing_Tests(TestCase):
+
+    def setUp(self):
+        for count in range(3):
+            CompletedCCO.objects.create(
+                form_name='form%s' % count,
+                form_data={'text': 'line one\nline two', 'multi': ['a', 'b'],
+                           'number': {'x': '1'}})
+
+    def test_print_rows_order(self):
+        self.assertEqual(
+            print_rows({'b': 'x', 'a': ['y'], 'c': {'n': 2}}, order=['c']),
+            [('c', ['n: 2']), ('a', ['y']), ('b', ['x'])])
+
+    def test_render_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'all.txt')
+        stats = render_completed(
+            CompletedCCO.objects.all(), output_file=path,
+            output_format='text', processes=1, chunk_size=2)
+        self.assertEqual(stats['count'], 3)
+        with open(path) as printed:
+            text = printed.read()
+        self.assertTrue(text.index('form0') < text.index('form2'))
+        self.assertTrue('  b\n' in text)
+
+    def test_render_dir_with_pool(self):
+        output_dir = tempfile.mkdtemp()
+        out = StringIO()
+        call_command(
+            'combinedchoices_print', output_dir=output_dir, processes=2,
+            form_name='form1', stdout=out)
+        self.assertEqual(out.getvalue()[:22], 'Rendered 1 completions')
+        completed = CompletedCCO.objects.get(form_name='form1')
+        with open(os.path.join(output_dir, '%s.html' % completed.pk)) as page:
+            html = page.read()
+        self.assertTrue('<li>line one<br />line two</li>' in html)
+
+
+class Submission_Tests(TestCase):
+
+    def setUp(self):
+        comp = mommy.make(BaseCCO, form_name='comp')
+        sect = mommy.make(
+            Section, field_name='single', field_type=Section.SINGLE)
+        cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+        self.choices = [
+            mommy.make(Choice, choice_section=cs, text=text)
+            for text in ('x', 'y')]
+        self.combined = mommy.make(ReadyCCO, included_forms=[comp])
+        ReadyForm(ready_obj=self.combined)
+
+    def payloads(self):
+        return [
+            {'form_name': 'done%s' % count,
+             'single': self.choices[count % 2].pk}
+            for count in range(5)] + [{'form_name': 'bad', 'single': 0}]
+
+    def test_submit_many(self):
+        with self.assertNumQueries(5):
+            result = submit_many(
+                self.combined, self.payloads(), batch_size=2)
+        self.assertEqual(result['created'], 5)
+        self.assertEqual(list(result['errors'].keys()), [5])
+        self.assertTrue('single' in result['errors'][5])
+        self.assertEqual(
+            CompletedCCO.objects.filter(
+                ready=self.combined, form_data__contains='"y"').count(), 2)
+
+    def test_counts_and_answers(self):
+        form_class = type(
+            'CountReadyForm', (ReadyForm,),
+            {'count_choices': True, 'store_answers': True})
+        form_class(ready_obj=self.combined)
+        with self.assertNumQueries(13):
+            submit_many(
+                self.combined, self.payloads()[:4], form_class=form_class)
+        submit_many(self.combined, self.payloads()[4:], form_class=form_class)
+        self.assertEqual(
+            choice_counts(self.combined), {'single': {'x': 3, 'y': 2}})
+        self.assertEqual(CompletedAnswer.objects.count(), 5)
+        for completed in CompletedCCO.objects.all():
+            self.assertEqual(
+                [answer.text for answer in completed.answers.all()],
+                [completed.form_data['single']])
+
+
+    def test_concurrent_insert(self):
+        # Another writer's row lands inside the batch's id range.
+        with connections['default'].cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TRIGGER concurrent_insert AFTER INSERT ON "
+                "combinedchoices_completedcco WHEN NEW.form_name = 'done1' "
+                "BEGIN INSERT INTO combinedchoices_completedcco "
+                "(form_name, form_data, created) "
+                "VALUES ('other', '{}', NEW.created); END")
+        form_class = type(
+            'AnswerReadyForm', (ReadyForm,), {'store_answers': True})
+        result = submit_many(
+            self.combined, self.payloads()[:4], form_class=form_class)
+        self.assertEqual(result, {'created': 4, 'errors': {}})
+        for completed in CompletedCCO.objects.exclude(form_name='other'):
+            self.assertEqual(
+                [answer.text for answer in completed.answers.all()],
+                [completed.form_data['single']])
+        self.assertEqual(CompletedAnswer.objects.count(), 4)
+        # The bulk insert was rolled back and the rows inserted one by one.
+        self.assertEqual(
+            CompletedCCO.objects.filter(form_name='other').count(), 1)
+
+
+class Clone_Tests(TestCase):
+
+    def setUp(self):
+        self.owner = mommy.make(User, username='owner')
+        self.other = mommy.make(User, username='other')
+        self.baseccos = []
+        sections = [
+            mommy.make(Section, field_name='section%s' % count,
+                       field_type=Section.MULTIPLE, user=self.owner)
+            for count in range(3)]
+        for count in range(2):
+            basecco = mommy.make(
+                BaseCCO, form_name='form%s' % count, user=self.owner)
+            for section in sections:
+                cs = mommy.make(
+                    ChoiceSection, basecco=basecco, section=section)
+                for text in ('a', 'b'):
+                    mommy.make(Choice, choice_section=cs, text=text)
+            self.baseccos.append(basecco)
+        self.combined = mommy.make(
+            ReadyCCO, form_name='ready', user=self.owner,
+            included_forms=self.baseccos)
+
+    def texts(self, basecco):
+        return sorted(Choice.objects.filter(
+            choice_section__basecco=basecco).values_list(
+            'choice_section__section__field_name', 'text'))
+
+    def test_clone_same_user(self):
+        copy = self.baseccos[0].clone(form_name='copy')
+        self.assertNotEqual(copy.pk, self.baseccos[0].pk)
+        self.assertEqual(copy.form_name, 'copy')
+        self.assertEqual(copy.user, self.owner)
+        self.assertEqual(self.texts(copy), self.texts(self.baseccos[0]))
+        self.assertEqual(
+            set(copy.sections.all()), set(self.baseccos[0].sections.all()))
+
+    def test_clone_other_user(self):
+        existing = mommy.make(Section, field_name='section0', user=self.other)
+        copy = self.baseccos[0].clone(user=self.other)
+        self.assertEqual(self.texts(copy), self.texts(self.baseccos[0]))
+        self.assertEqual(
+            Section.objects.filter(user=self.other).count(), 3)
+        self.assertTrue(existing in copy.sections.all())
+        for section in copy.sections.all():
+            self.assertEqual(section.user, self.other)
+
+    def test_clone_rename(self):
+        copy = self.baseccos[0].clone(
+            rename_section=lambda name: '%s copy' % name)
+        self.assertEqual(
+            sorted(copy.sections.values_list('field_name', flat=True)),
+            ['section0 copy', 'section1 copy', 'section2 copy'])
+        for section in Section.objects.filter(user=self.owner):
+            section.validate_unique()
+
+    def test_clone_rename_merges(self):
+        section = Section.objects.get(field_name='section1')
+        Choice.objects.filter(
+            choice_section__section=section, text='b').update(text='c')
+        copy = self.baseccos[0].clone(rename_section=lambda name: 'merged')
+        self.assertEqual(
+            list(copy.sections.values_list('field_name', flat=True)),
+            ['merged'])
+        self.assertEqual(
+            self.texts(copy),
+            [('merged', 'a'), ('merged', 'b'), ('merged', 'c')])
+
+    def test_clone_unowned(self):
+        copy = self.baseccos[0].clone(user=None)
+        self.assertEqual(copy.user, None)
+        self.assertRaises(TypeError, self.baseccos[0].clone, owner=None)
+
+    def test_clone_ready_queries(self):
+        with self.assertNumQueries(18):
+            ready = self.combined.clone(user=self.other)
+        self.assertEqual(ready.user, self.other)
+        self.assertEqual(ready.included_forms.count(), 2)
+        form = ReadyForm(ready_obj=ready)
+        self.assertEqual(
+            sorted(form.fields.keys()),
+            sorted(ReadyForm(ready_obj=self.combined).fields.keys()))
+        copy = BaseCCO.objects.create(form_name='form2', user=self.owner)
+        for section in Section.objects.filter(user=self.owner):
+            cs = mommy.make(ChoiceSection, basecco=copy, section=section)
+            mommy.make(Choice, choice_section=cs, _quantity=3)
+        self.combined.included_forms.add(copy)
+        with self.assertNumQueries(16):
+            self.combined.clone(user=self.other, form_name='again')
+
+
+class Constraint_Tests(TestCase):
+
+    def test_user_validate_without_query(self):
+        user = mommy.make(User)
+        mod = Section(field_name='testuni', field_type=1, user=user)
+        with self.assertNumQueries(0):
+            mod.validate_unique()
+
+    def test_user_duplicate(self):
+        user = mommy.make(User)
+        mommy.make(Section, field_name='testuni', user=user)
+        mod = Section(field_name='testuni', field_type=1, user=user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            mod.save()
+        self.assertEqual(Section.objects.count(), 1)
+        Section.objects.create(field_name='testuni', field_type=1)
+
+    def test_form_duplicate(self):
+        user = mommy.make(User)
+        existing = mommy.make(Section, field_name='testuni', user=user)
+        data = {'field_name': 'testuni', 'field_type': 1,
+                'min_selects': 1, 'max_selects': 1}
+        form = SectionForm(data, user=user)
+        with self.assertNumQueries(0):
+            self.assertTrue(form.is_valid())
+        self.assertRaises(ValidationError, form.save)
+        self.assertEqual(list(form.errors), ['field_name'])
+        self.assertEqual(Section.objects.filter(user=user).count(), 1)
+        self.assertTrue(SectionForm(data, instance=existing).is_valid())
+        self.assertTrue(SectionForm(data, user=mommy.make(User)).is_valid())
+        Section.objects.create(field_name='testuni', field_type=1)
+        form = SectionForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(list(form.errors), ['field_name'])
+
+    def test_choice_section_unique(self):
+        cs = mommy.make(ChoiceSection)
+        self.assertRaises(
+            IntegrityError, ChoiceSection.objects.create,
+            basecco=cs.basecco, section=cs.section)
+
+
+class DedupeMigration_Tests(TransactionTestCase):
+    before = [('combinedchoices', '0006_readysnapshot')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connections['default'])
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def test_dedupe(self):
+        latest = [MigrationLoader(connections['default']).graph.leaf_nodes(
+            'combinedchoices')[0]]
+        old_apps = self.migrate(self.before)
+        try:
+            user = User.objects.create(username='dupes')
+            models = dict(
+                (name, old_apps.get_model('combinedchoices', name))
+                for name in ('Section', 'BaseCCO', 'ChoiceSection', 'Choice'))
+            first, second, third = [
+                models['Section'].objects.create(
+                    user_id=user.id, field_name='same', field_type=1)
+                for count in range(3)]
+            basecco = models['BaseCCO'].objects.create(form_name='form')
+            links = [
+                models['ChoiceSection'].objects.create(
+                    basecco=basecco, section=first)
+                for count in range(2)]
+            for link in links:
+                models['Choice'].objects.create(choice_section=link, text='x')
+        finally:
+            self.migrate(latest)
+        self.assertEqual(
+            list(Section.objects.order_by('id').values_list(
+                'field_name', flat=True)),
+            ['same', 'same (%s)' % second.id, 'same (%s)' % third.id])
+        self.assertEqual(ChoiceSection.objects.get().id, links[0].id)
+        self.assertEqual(
+            Choice.objects.filter(choice_section_id=links[0].id).count(), 2)
+
+
+@override_settings(
+    COMBINEDCHOICES_REPLICA_DBS=['replica'],
+    COMBINEDCHOICES_SHARD_DBS=['shard_a', 'shard_b'])
+class Router_Tests(TestCase):
+
+    def setUp(self):
+        self.router = CombinedChoicesRouter()
+        unpin()
+
+    def tearDown(self):
+        unpin()
+
+    def outside_atomic(self):
+        # TestCase wraps every test in a transaction, which pins reads.
+        connection = connections['default']
+        atomic, connection.in_atomic_block = connection.in_atomic_block, False
+        self.addCleanup(setattr, connection, 'in_atomic_block', atomic)
+
+    def test_definition_reads_use_replica(self):
+        self.outside_atomic()
+        self.assertEqual(self.router.db_for_read(Section), 'replica')
+        self.assertEqual(self.router.db_for_read(CompletedCCO), None)
+
+    def test_transaction_reads_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Section), 'default')
+
+    def test_write_pins_primary(self):
+        self.outside_atomic()
+        self.assertEqual(self.router.db_for_write(Choice), 'default')
+        self.assertEqual(self.router.db_for_read(BaseCCO), 'default')
+        unpin()
+        self.assertEqual(self.router.db_for_read(BaseCCO), 'replica')
+        pin_primary()
+        self.assertEqual(self.router.db_for_read(BaseCCO), 'default')
+
+    def test_completed_sharded_by_user(self):
+        first = CompletedCCO(user_id=1)
+        used = set(
+            self.router.db_for_write(
+                CompletedCCO, instance=CompletedCCO(user_id=user_id))
+            for user_id in range(20))
+        self.assertEqual(used, set(['shard_a', 'shard_b']))
+        answer = CompletedAnswer(completed=first)
+        self.assertEqual(
+            self.router.db_for_write(CompletedAnswer, instance=answer),
+            self.router.db_for_write(CompletedCCO, instance=first))
+
+    def test_allow_migrate(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'combinedchoices'))
+        self.assertTrue(self.router.allow_migrate(
+            'shard_a', 'combinedchoices', 'completedcco'))
+        self.assertTrue(self.router.allow_migrate(
+            'default', 'combinedchoices', 'completedcco'))
+        self.assertTrue(self.router.allow_migrate(
+            'shard_a', 'combinedchoices', 'readycco'))
+        self.assertTrue(self.router.allow_migrate(
+            'default', 'combinedchoices', 'section'))
+        self.assertIsNone(self.router.allow_migrate('default', 'auth', 'user'))
+
+
+SHARDS = ['shard_a', 'shard_b']
+SHARDED = override_settings(
+    DATABASE_ROUTERS=['combinedchoices.routers.CombinedChoicesRouter'],
+    COMBINEDCHOICES_SHARD_DBS=SHARDS)
+
+
+class Sharding_Tests(TestCase):
+    multi_db = True
+
+    @classmethod
+    def setUpClass(cls):
+        # Two in-memory SQLite shards, migrated through the router.
+        for alias in SHARDS:
+            connections.databases[alias] = {
+                'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+            connections.ensure_defaults(alias)
+            with SHARDED:
+                call_command(
+                    'migrate', database=alias, verbosity=0,
+                    interactive=False)
+        SHARDED.enable()
+        super(Sharding_Tests, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(Sharding_Tests, cls).tearDownClass()
+        SHARDED.disable()
+        for alias in SHARDS:
+            connections[alias].close()
+            delattr(connections._connections, alias)
+            del connections.databases[alias]
+
+    def setUp(self):
+        self.users = {}
+        for count in range(20):
+            user = mommy.make(User)
+            self.users.setdefault(
+                CombinedChoicesRouter().db_for_write(
+                    CompletedCCO, instance=CompletedCCO(user=user)), user)
+        sect = mommy.make(
+            Section, field_name='single', field_type=Section.SINGLE)
+        comp = mommy.make(BaseCCO, form_name='comp')
+        cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+        self.choice = mommy.make(Choice, choice_section=cs, text='x')
+        self.combined = mommy.make(ReadyCCO, included_forms=[comp])
+        self.form_class = type('ShardedReadyForm', (ReadyForm,), {
+            'store_answers': True, 'count_choices': True, 'owner_id': None,
+            'completed_kwargs': lambda form, **kwargs: dict(
+                ReadyForm.completed_kwargs(form, **kwargs),
+                user_id=form.owner_id)})
+
+    def complete(self, alias):
+        self.form_class.owner_id = self.users[alias].pk
+        form = self.form_class(
+            {'form_name': 'done', 'single': self.choice.pk},
+            ready_obj=self.combined)
+        self.assertTrue(form.is_valid())
+        return form.save()
+
+    def test_tables(self):
+        for alias in SHARDS:
+            tables = connections[alias].introspection.table_names()
+            self.assertTrue('combinedchoices_completedcco' in tables)
+            self.assertTrue('combinedchoices_readycco' in tables)
+
+    def test_completions_on_shards(self):
+        for alias in SHARDS:
+            completed = self.complete(alias)
+            self.assertEqual(completed._state.db, alias)
+            stored = CompletedCCO.objects.using(alias).get()
+            self.assertEqual(stored.user, self.users[alias])
+            self.assertEqual(stored.ready, self.combined)
+            self.assertEqual(list(stored.answers.values_list(
+                'text', flat=True)), ['x'])
+        self.assertEqual(choice_counts(self.combined), {'single': {'x': 2}})
+        self.assertEqual(
+            sorted(record['user'] for record in iter_records()),
+            sorted(user.pk for user in self.users.values()))
+        self.assertEqual(rebuild_choice_counts(), 1)
+        self.assertEqual(choice_counts(self.combined), {'single': {'x': 2}})
+
+    def test_records_name_shard(self):
+        for alias in SHARDS:
+            self.complete(alias)
+        records = list(iter_records())
+        self.assertEqual(
+            [(record['shard'], record['id']) for record in records],
+            [(alias, 1) for alias in SHARDS])
+        output_dir = tempfile.mkdtemp()
+        render_completed(
+            CompletedCCO.objects.all(), output_dir=output_dir,
+            output_format='text', processes=1)
+        self.assertEqual(
+            sorted(os.listdir(output_dir)),
+            ['%s-1.txt' % alias for alias in SHARDS])
+
+    def test_deletes_reach_shards(self):
+        completed = dict((alias, self.complete(alias)) for alias in SHARDS)
+        self.assertEqual(CompletedCCO.objects.count(), 0)
+        self.combined.delete()
+        for alias in SHARDS:
+            stored = CompletedCCO.objects.using(alias).get()
+            self.assertIsNone(stored.ready_id)
+        self.choice.delete()
+        self.assertEqual(
+            CompletedAnswer.objects.using(SHARDS[0]).get().choice_id, None)
+        self.users[SHARDS[0]].delete()
+        self.assertFalse(
+            CompletedCCO.objects.using(SHARDS[0]).exists())
+        self.assertFalse(
+            CompletedAnswer.objects.using(SHARDS[0]).exists())
+        self.assertEqual(
+            CompletedCCO.objects.using(SHARDS[1]).get(),
+            completed[SHARDS[1]])
+
+    def test_submit_many(self):
+        payloads = [{'form_name': 'done', 'single': self.choice.pk}] * 2
+        for alias in SHARDS:
+            self.form_class.owner_id = self.users[alias].pk
+            submit_many(self.combined, payloads, form_class=self.form_class)
+            self.assertEqual(
+                CompletedAnswer.objects.using(alias).count(), 2)
+        self.assertEqual(len(list(iter_records())), 4)
+        self.assertEqual(choice_counts(self.combined), {'single': {'x': 4}})
+
+    def test_compress_form_data(self):
+        for alias in SHARDS:
+            self.complete(alias)
+            CompletedCCO.objects.using(alias).update(
+                form_data=RawJSON(json.dumps({'single': 'x' * 500})))
+        self.assertEqual(convert_form_data(compress=True), 2)
+        for alias in SHARDS:
+            self.assertTrue(CompletedCCO.objects.using(alias).values_list(
+                'form_data', flat=True)[0].compressed)
+        self.assertEqual(convert_form_data(compress=False), 2)
+
+    def test_admin_shard_filter(self):
+        for alias in SHARDS:
+            self.complete(alias)
+        model_admin = admin.site._registry[CompletedCCO]
+        for alias in SHARDS:
+            request = RequestFactory().get('/', {'shard': alias})
+            request.user = mommy.make(User, is_superuser=True)
+            response = model_admin.changelist_view(request)
+            results = response.context_data['cl'].result_list
+            self.assertEqual(
+                [completed.user for completed in results],
+                [self.users[alias]])
+            request = RequestFactory().get('/', {
+                '_changelist_filters': 'shard=%s' % alias})
+            self.assertEqual(model_admin.get_queryset(request).db, alias)
+
+
+class Admin_Tests(TestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User, is_superuser=True)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+        self.messages = []
+
+    def model_admin(self, model):
+        model_admin = admin.site._registry[model]
+        # Shadows ModelAdmin.message_user on the shared registered instance
+        # for this test only.
+        if 'message_user' not in vars(model_admin):
+            self.addCleanup(delattr, model_admin, 'message_user')
+        model_admin.message_user = (
+            lambda request, message: self.messages.append(message))
+        return model_admin
+
+    def test_paginator_counts_without_estimate(self):
+        mommy.make(CompletedCCO, _quantity=3)
+        queryset = CompletedCCO.objects.order_by('id')
+        self.assertIsNone(estimated_count(queryset))
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 3)
+        self.assertIsInstance(
+            self.model_admin(CompletedCCO).get_paginator(
+                self.request, queryset, 2), EstimatedCountPaginator)
+
+    @override_settings(COMBINEDCHOICES_ADMIN_INLINE_LIMIT=2)
+    def test_large_choice_inline_hidden(self):
+        model_admin = self.model_admin(ChoiceSection)
+        small = mommy.make(ChoiceSection)
+        mommy.make(Choice, choice_section=small, _quantity=2)
+        large = mommy.make(ChoiceSection)
+        mommy.make(Choice, choice_section=large, _quantity=3)
+        self.assertEqual(
+            len(model_admin.get_inline_instances(self.request, small)), 1)
+        self.assertEqual(
+            model_admin.get_inline_instances(self.request, large), [])
+
+    def test_stream_export(self):
+        mommy.make(CompletedCCO, form_name='a', form_data={'x': 1},
+                   _quantity=2)
+        model_admin = self.model_admin(CompletedCCO)
+        response = model_admin.actions[0](
+            model_admin, self.request, CompletedCCO.objects.all())
+        lines = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0].decode('utf-8'))['form_data'],
+                         {'x': 1})
+
+    def test_clone_actions(self):
+        basecco = mommy.make(BaseCCO, form_name='comp', user=self.user)
+        cs = mommy.make(ChoiceSection, basecco=basecco,
+                        section__user=self.user)
+        mommy.make(Choice, choice_section=cs, _quantity=2)
+        model_admin = self.model_admin(BaseCCO)
+        model_admin.actions[0](
+            model_admin, self.request, BaseCCO.objects.all())
+        copy = BaseCCO.objects.get(form_name='comp (copy)')
+        self.assertEqual(copy.user, self.user)
+        self.assertEqual(Choice.objects.filter(
+            choice_section__basecco=copy).count(), 2)
+        ready = mommy.make(
+            ReadyCCO, form_name='ready', included_forms=[basecco],
+            user=self.user)
+        model_admin = self.model_admin(ReadyCCO)
+        model_admin.actions[0](
+            model_admin, self.request, ReadyCCO.objects.filter(id=ready.id))
+        self.assertTrue(
+            ReadyCCO.objects.filter(form_name='ready (copy)').exists())
+        self.assertEqual(len(self.messages), 2)
+
+
+@override_settings(ROOT_URLCONF='combinedchoices.urls')
+class SchemaView_Tests(TestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User)
+        comp = mommy.make(BaseCCO, form_name='comp', user=self.user)
+        sect = mommy.make(
+            Section, field_name='pick', field_type=Section.SINGLE,
+            instructions='Pick one', user=self.user)
+        cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+        self.choice = mommy.make(Choice, choice_section=cs, text='apple')
+        self.combined = mommy.make(
+            ReadyCCO, form_name='ready', included_forms=[comp],
+            user=self.user)
+
+    def request(self, **headers):
+        request = RequestFactory().get('/', **headers)
+        request.user = self.user
+        return ready_schema(request, ready_id='%s' % self.combined.pk)
+
+    def test_layout(self):
+        response = self.request()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(data['form_name'], 'ready')
+        field = data['fields'][0]
+        self.assertEqual(field['name'], 'pick')
+        self.assertEqual(field['help_text'], 'Pick one')
+        self.assertEqual(field['choices'], [[self.choice.pk, 'apple']])
+
+    def test_not_modified(self):
+        etag = self.request()['ETag']
+        with self.assertNumQueries(1):
+            response = self.request(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_changes_with_definition(self):
+        etag = self.request()['ETag']
+        self.choice.text = 'apricot'
+        self.choice.save()
+        response = self.request(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_other_user(self):
+        request = RequestFactory().get('/')
+        request.user = mommy.make(User)
+        self.assertRaises(
+            Http404, ready_schema, request, ready_id='%s' % self.combined.pk)
+
+
+class Search_Tests(TestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User)
+        self.cs = mommy.make(
+            ChoiceSection, basecco__user=self.user, section__user=self.user)
+        self.choices = dict(
+            (text, mommy.make(Choice, choice_section=self.cs, text=text))
+            for text in ('red apple', 'apple apple pie', 'green pear'))
+        mommy.make(Choice, text='apple of another user')
+
+    def texts(self, query, **kwargs):
+        choices, has_next = search.search_choices(
+            query, user=self.user, **kwargs)
+        return [choice.text for choice in choices]
+
+    def require_fts5(self):
+        # Ranking and prefix matches need SQLite built with FTS5.
+        if search.search_backend('default') != 'fts5':
+            self.skipTest('SQLite FTS5 is not available')
+
+    def test_indexed(self):
+        self.require_fts5()
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM %s' % search.FTS_TABLE)
+            self.assertEqual(cursor.fetchone()[0], Choice.objects.count())
+
+    def test_ranked_and_scoped(self):
+        self.require_fts5()
+        self.assertEqual(
+            self.texts('apple'), ['apple apple pie', 'red apple'])
+        self.assertEqual(self.texts('app"le'), [])
+        self.assertEqual(self.texts('gre pe'), ['green pear'])
+        self.assertEqual(self.texts('pear', section=self.cs.section_id),
+                         ['green pear'])
+        self.assertEqual(self.texts('pear', basecco=mommy.make(BaseCCO)), [])
+
+    def test_index_follows_writes(self):
+        choice = self.choices['green pear']
+        choice.text = 'green plum'
+        choice.save()
+        self.assertEqual(self.texts('pear'), [])
+        self.assertEqual(self.texts('plum'), ['green plum'])
+        Choice.objects.bulk_create([
+            Choice(choice_section=self.cs, text='plum jam')])
+        Choice.objects.filter(text='green plum').delete()
+        self.assertEqual(self.texts('plum'), ['plum jam'])
+
+    def test_pages(self):
+        self.require_fts5()
+        choices, has_next = search.search_choices(
+            'apple', user=self.user, page_size=1)
+        self.assertTrue(has_next)
+        choices, has_next = search.search_choices(
+            'apple', user=self.user, page=2, page_size=1)
+        self.assertEqual([choice.text for choice in choices], ['red apple'])
+        self.assertFalse(has_next)
+
+    def test_fallback(self):
+        search.backends['default'] = None
+        self.addCleanup(search.backends.pop, 'default')
+        self.assertEqual(
+            self.texts('apple'), ['red apple', 'apple apple pie'])
+
+    def test_trigram_uses_ilike(self):
+        search.backends['default'] = 'trigram'
+        self.addCleanup(search.backends.pop, 'default')
+        queryset = search.ranked_choices(Choice.objects.all(), '5%_off')
+        sql, params = queryset.query.sql_with_params()
+        self.assertIn('.text ILIKE %s', sql)
+        self.assertNotIn('UPPER', sql)
+        self.assertIn('%5\\%\\_off%', params)
+
+    def test_rebuild_command(self):
+        self.require_fts5()
+        out = StringIO()
+        call_command('combinedchoices_rebuild_search', stdout=out)
+        self.assertIn('Rebuilt', out.getvalue())
+        self.assertEqual(self.texts('pear'), ['green pear'])
+
+    def test_view(self):
+        self.require_fts5()
+        request = RequestFactory().get('/', {'q': 'apple'})
+        request.user = self.user
+        data = json.loads(choice_search(request).content.decode('utf-8'))
+        self.assertEqual(
+            [result['id'] for result in data['results']],
+            [self.choices['apple apple pie'].pk,
+             self.choices['red apple'].pk])
+
+
+class MergedChoice_Tests(TestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User)
+        self.comps = []
+        self.choices = []
+        for form_name in ('first', 'second'):
+            comp = mommy.make(BaseCCO, form_name=form_name, user=self.user)
+            for field_name, cross in (('cross', True), ('uncross', False)):
+                sect, created = Section.objects.get_or_create(
+                    field_name=field_name, user=self.user, defaults={
+                        'field_type': Section.MULTIPLE,
+                        'cross_combine': cross})
+                cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+                self.choices.append(
+                    mommy.make(Choice, choice_section=cs, text='shared'))
+                mommy.make(Choice, choice_section=cs, text=form_name)
+            self.comps.append(comp)
+        self.combined = mommy.make(
+            ReadyCCO, included_forms=self.comps, user=self.user)
+
+    def test_cross_combine_merged(self):
+        form = ReadyForm(ready_obj=self.combined)
+        self.assertIn(
+            (self.choices[0].pk, 'shared'), form.fields['cross'].widget.choices)
+        texts = [text for pk, text in form.fields['cross'].widget.choices]
+        self.assertEqual(texts, ['first', 'second', 'shared'])
+        self.assertEqual(
+            [text for pk, text in
+             form.fields['first - uncross'].widget.choices],
+            ['shared', 'first'])
+
+    def test_merged_duplicate_posted(self):
+        form = ReadyForm({
+            'form_name': 'done', 'cross': [self.choices[2].pk],
+            'first - uncross': [self.choices[1].pk],
+            'second - uncross': [self.choices[3].pk],
+        }, ready_obj=self.combined)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(
+            [choice.pk for choice in form.cleaned_data['cross']],
+            [self.choices[0].pk])
+        self.assertEqual(form.save().form_data['cross'], ['shared'])
+
+    def test_snapshot_unchanged(self):
+        form_class = type(
+            'SnapshotReadyForm', (ReadyForm,), {'snapshot': True})
+        form = form_class({
+            'form_name': 'done', 'cross': [self.choices[0].pk],
+            'first - uncross': [self.choices[1].pk],
+            'second - uncross': [self.choices[3].pk],
+        }, ready_obj=self.combined)
+        self.assertTrue(form.is_valid(), form.errors)
+        snapshot = ReadySnapshot.objects.get(pk=form.save().snapshot_id)
+        self.assertEqual(
+            diff_schemas(snapshot.schema, form.schema)['changed'], [])
+
+    def test_lowest_id_kept(self):
+        choices, aliases = merge_choices([
+            Choice(pk=5, text='a'), Choice(pk=2, text='b'),
+            Choice(pk=3, text='a')])
+        self.assertEqual(choices, [(3, 'a'), (2, 'b')])
+        self.assertEqual(aliases, [[5, 3]])
+
+    def test_import_keeps_repeated_text(self):
+        counts = import_definition({
+            'sections': [{'field_name': 'single', 'field_type': 'single'}],
+            'baseccos': [{'form_name': 'form', 'sections': {
+                'single': ['a', 'b', 'a']}}],
+        }, user=mommy.make(User))
+        self.assertEqual(counts['choices'], 3)
+
+
+@override_settings(COMBINEDCHOICES_STEP_SIZE=2)
+class Step_Tests(TestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User)
+        comp = mommy.make(BaseCCO, form_name='comp', user=self.user)
+        self.choices = {}
+        for field_name in ('a', 'b', 'c'):
+            sect = mommy.make(
+                Section, field_name=field_name, field_type=Section.SINGLE,
+                user=self.user)
+            cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+            self.choices[field_name] = mommy.make(
+                Choice, choice_section=cs, text='%s choice' % field_name)
+        self.combined = mommy.make(
+            ReadyCCO, included_forms=[comp], user=self.user)
+        self.storage = SessionStepStorage(SessionStore(), self.combined)
+
+    def step_form(self, step, data=None):
+        return ReadyForm(
+            data, ready_obj=self.combined, step=step, storage=self.storage)
+
+    def test_step_fields(self):
+        ReadyForm(ready_obj=self.combined)
+        with self.assertNumQueries(0):
+            form = self.step_form(0)
+        self.assertEqual(list(form.fields), ['a', 'b'])
+        self.assertFalse(form.final)
+        form = self.step_form(1)
+        self.assertEqual(list(form.fields), ['form_name', 'c'])
+        self.assertTrue(form.final)
+
+    def test_steps_assemble_one_completed(self):
+        form = self.step_form(0, {
+            'a': self.choices['a'].pk, 'b': self.choices['b'].pk})
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertIsNone(form.save())
+        self.assertEqual(CompletedCCO.objects.count(), 0)
+        form = self.step_form(1, {
+            'form_name': 'done', 'c': self.choices['c'].pk})
+        self.assertTrue(form.is_valid(), form.errors)
+        completed = form.save()
+        self.assertEqual(completed.form_name, 'done')
+        self.assertEqual(completed.form_data, {
+            'a': 'a choice', 'b': 'b choice', 'c': 'c choice'})
+        self.assertEqual(self.storage.load(), {})
+
+    def test_sections_subset(self):
+        form = ReadyForm(
+            {'c': self.choices['c'].pk}, ready_obj=self.combined,
+            sections=['c'], storage=self.storage)
+        self.assertEqual(list(form.fields), ['c'])
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        self.assertEqual(
+            self.storage.merge({}, [])[0], {'c': 'c choice'})
+        form = ReadyForm(
+            {'form_name': 'done', 'a': self.choices['a'].pk,
+             'b': self.choices['b'].pk},
+            ready_obj=self.combined, sections=['a', 'b'],
+            storage=self.storage)
+        self.assertTrue(form.final)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.save().form_data, {
+            'a': 'a choice', 'b': 'b choice', 'c': 'c choice'})
+
+    def test_invalid_steps(self):
+        self.assertRaises(
+            ValueError, ReadyForm, ready_obj=self.combined, step=0)
+        self.assertRaises(ValueError, self.step_form, 2)
+        self.assertRaises(ValueError, self.step_form, -1)
+
+    def test_final_needs_earlier_steps(self):
+        form = self.step_form(1, {
+            'form_name': 'done', 'c': self.choices['c'].pk})
+        self.assertFalse(form.is_valid())
+        self.assertIn('a, b', form.non_field_errors()[0])
+
+    def test_merge_order(self):
+        for step in (10, 9):
+            self.storage.save_step(step, {}, [('f%s' % step, None, 'x', '')])
+        self.assertEqual(
+            [answer[0] for answer in self.storage.merge({}, [])[1]],
+            ['f9', 'f10'])
+
+    def test_tokens_kept_apart(self):
+        other = SessionStepStorage(
+            self.storage.session, self.combined, new_token())
+        form = self.step_form(0, {
+            'a': self.choices['a'].pk, 'b': self.choices['b'].pk})
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        form = ReadyForm(
+            {'a': self.choices['a'].pk, 'b': self.choices['b'].pk},
+            ready_obj=self.combined, step=0, storage=other)
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        other.clear()
+        self.assertEqual(self.storage.saved_names(), set(['a', 'b']))
+
+    def test_stale_steps_dropped(self):
+        self.storage.save_step(
+            0, {'a': 'a choice', 'b': 'b choice'}, [], ['a', 'b'],
+            version='old')
+        form = self.step_form(1, {
+            'form_name': 'done', 'c': self.choices['c'].pk})
+        self.assertFalse(form.is_valid())
+        self.assertIn('a, b', form.non_field_errors()[0])
+        self.assertEqual(self.storage.load(), {})
+        self.assertEqual(
+            self.storage.merge({}, [], version=form.schema_version())[0], {})
+
+
+class UncachedForm(ReadyForm):
+    cache_fragments = False
+
+
+@override_settings(COMBINEDCHOICES_CACHE_FRAGMENTS=True)
+class Fragment_Tests(TestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User)
+        comp = mommy.make(BaseCCO, form_name='comp', user=self.user)
+        self.choices = {}
+        for field_name, field_type in (
+                ('single', Section.SINGLE), ('multi', Section.MULTIPLE),
+                ('number', Section.NUMBER)):
+            sect = mommy.make(
+                Section, field_name=field_name, field_type=field_type,
+                user=self.user)
+            cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+            self.choices[field_name] = [
+                mommy.make(Choice, choice_section=cs, text=text)
+                for text in ('one', 'two', 'three')]
+        self.combined = mommy.make(
+            ReadyCCO, included_forms=[comp], user=self.user)
+
+    def assertSameHtml(self, data=None):
+        html = ReadyForm(data, ready_obj=self.combined).as_p()
+        self.assertEqual(
+            html, UncachedForm(data, ready_obj=self.combined).as_p())
+        return html
+
+    def test_unbound(self):
+        html = self.assertSameHtml()
+        self.assertEqual(html, self.assertSameHtml())
+        form = ReadyForm(ready_obj=self.combined)
+        self.assertIsNotNone(form.fields['single'].widget.fragment_key)
+        self.assertIsNone(
+            UncachedForm(ready_obj=self.combined).fields[
+                'single'].widget.fragment_key)
+
+    def test_bound_patched(self):
+        self.assertSameHtml()
+        html = self.assertSameHtml({
+            'single': self.choices['single'][1].pk,
+            'multi': [self.choices['multi'][0].pk,
+                      self.choices['multi'][2].pk],
+            'number_0': '2', 'number_1': '', 'number_2': '5'})
+        self.assertEqual(html.count('checked="checked"'), 3)
+        self.assertSameHtml({'single': 'bad', 'multi': ['bad']})
+        widget = ReadyForm(ready_obj=self.combined).fields['multi'].widget
+        attrs = {'id': 'id_multi'}
+        self.assertIsNotNone(widget.check_inputs(
+            widget.cached_fragment('multi', [], attrs), 'multi',
+            ['%s' % self.choices['multi'][1].pk], attrs))
+
+    def test_bound_numbers_not_cached(self):
+        self.assertSameHtml()
+        cache = get_cache()
+        keys = []
+        cache_set = cache.set
+        cache.set = lambda key, *args: keys.append(key) or cache_set(
+            key, *args)
+        self.addCleanup(delattr, cache, 'set')
+        html = self.assertSameHtml({'number_0': '7', 'number_1': 'x' * 50})
+        self.assertIn('value="7"', html)
+        self.assertEqual(keys, [])
+
+    def test_key_length(self):
+        form = ReadyForm(ready_obj=self.combined)
+        key = form.fragment_key({'section': 1, 'baseccos': range(1000)})
+        self.assertLess(len(key), 100)
+
+    def test_invalidated_by_choice_save(self):
+        self.assertSameHtml()
+        choice = self.choices['multi'][0]
+        choice.text = 'changed'
+        choice.save()
+        self.assertIn('changed', self.assertSameHtml())
+
+
+class CompressedFormData_Tests(TestCase):
+
+    data = {'essay': 'a long answer ' * 50, 'pick': ['one', 'two']}
+
+    def stored(self, completed):
+        return CompletedCCO.objects.values_list(
+            'form_data', flat=True).get(pk=completed.pk)
+
+    def test_plain_by_default(self):
+        completed = mommy.make(CompletedCCO, form_data=self.data)
+        self.assertEqual(json.loads(self.stored(completed)), self.data)
+
+    @override_settings(COMBINEDCHOICES_COMPRESS_FORM_DATA=True)
+    def test_compressed_and_lazy(self):
+        completed = mommy.make(CompletedCCO, form_data=self.data)
+        stored = self.stored(completed)
+        self.assertTrue(stored.compressed)
+        self.assertLess(len(stored), len(json.dumps(self.data)))
+        loaded = CompletedCCO.objects.get(pk=completed.pk)
+        self.assertIsInstance(loaded.__dict__['form_data'], RawJSON)
+        self.assertEqual(loaded.form_data, self.data)
+        self.assertEqual(loaded.__dict__['form_data'], self.data)
+
+    @override_settings(COMBINEDCHOICES_COMPRESS_FORM_DATA=True)
+    def test_fixture_round_trip(self):
+        completed = mommy.make(CompletedCCO, form_data=self.data)
+        dumped = serializers.serialize('json', [completed])
+        CompletedCCO.objects.all().delete()
+        for restored in serializers.deserialize('json', dumped):
+            restored.save()
+        self.assertEqual(
+            CompletedCCO.objects.get(pk=completed.pk).form_data, self.data)
+        self.assertTrue(self.stored(completed).compressed)
+
+    def test_assigned_text(self):
+        completed = mommy.make(CompletedCCO)
+        completed.form_data = json.dumps(self.data)
+        self.assertEqual(completed.form_data, self.data)
+        completed.save()
+        self.assertEqual(json.loads(self.stored(completed)), self.data)
+        with self.assertRaises(ValidationError):
+            completed.form_data = 'not json'
+
+    @override_settings(COMBINEDCHOICES_COMPRESS_FORM_DATA=True)
+    def test_small_payload_stays_plain(self):
+        completed = mommy.make(CompletedCCO, form_data={'a': 1})
+        self.assertEqual(self.stored(completed), '{"a":1}')
+
+    def test_convert_command(self):
+        completed = [
+            mommy.make(CompletedCCO, form_data=self.data) for i in range(3)]
+        out = StringIO()
+        with self.assertNumQueries(4):
+            call_command(
+                'combinedchoices_compress_form_data', chunk_size=2,
+                stdout=out)
+        self.assertIn('3', out.getvalue())
+        self.assertTrue(all(
+            self.stored(completed_obj).compressed
+            for completed_obj in completed))
+        self.assertEqual(
+            CompletedCCO.objects.get(pk=completed[0].pk).form_data, self.data)
+        call_command(
+            'combinedchoices_compress_form_data', expand=True, stdout=out)
+        self.assertFalse(self.stored(completed[0]).compressed)
+
+    def test_unchanged_row_not_reencoded(self):
+        completed = mommy.make(CompletedCCO, form_data=self.data)
+        loaded = CompletedCCO.objects.get(pk=completed.pk)
+        loaded.form_name = 'renamed'
+        with override_settings(COMBINEDCHOICES_COMPRESS_FORM_DATA=True):
+            loaded.save()
+        self.assertFalse(self.stored(completed).compressed)
+
+
+class CountingCompileForm(ReadyForm):
+    compiles = 0
+
+    @classmethod
+    def compile_schema(cls, ready_obj, results=None):
+        cls.compiles += 1
+        return super(CountingCompileForm, cls).compile_schema(
+            ready_obj, results)
+
+
+@skipIf(aio is None, 'combinedchoices.aio requires Python 3.5+')
+class Async_Tests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = mommy.make(User)
+        comp = mommy.make(BaseCCO, form_name='comp', user=self.user)
+        sect = mommy.make(
+            Section, field_name='pick', field_type=Section.SINGLE,
+            user=self.user)
+        cs = mommy.make(ChoiceSection, basecco=comp, section=sect)
+        self.choice = mommy.make(Choice, choice_section=cs, text='apple')
+        self.combined = mommy.make(
+            ReadyCCO, included_forms=[comp], user=self.user)
+
+    def run_async(self, coroutine):
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def test_form_matches_sync(self):
+        ready = self.run_async(aio.aget_ready(
+            id=self.combined.pk, user=self.user))
+        form = self.run_async(aio.aready_form(ready))
+        self.assertEqual(
+            form.schema, ReadyForm(ready_obj=self.combined).schema)
+        self.assertRaises(Http404, self.run_async, aio.aget_ready(
+            id=self.combined.pk, user=mommy.make(User)))
+
+    def test_schema_cached(self):
+        # The queries run on pool threads, out of assertNumQueries' sight.
+        CountingCompileForm.compiles = 0
+        for attempt in range(2):
+            self.run_async(aio.aload_schema(
+                self.combined, form_class=CountingCompileForm))
+        self.assertEqual(CountingCompileForm.compiles, 1)
+        self.assertEqual(
+            CountingCompileForm.load_schema(self.combined),
+            self.run_async(aio.aload_schema(
+                self.combined, form_class=CountingCompileForm)))
+        self.assertEqual(CountingCompileForm.compiles, 1)
+
+    def test_save(self):
+        form = self.run_async(aio.aready_form(
+            self.combined, {'form_name': 'done', 'pick': self.choice.pk}))
+        self.assertTrue(form.is_valid(), form.errors)
+        completed = self.run_async(aio.asave(form))
+        self.assertEqual(
+            CompletedCCO.objects.get(pk=completed.pk).form_data,
+            {'pick': 'apple'})
+
+
+class SectionMatrix_Tests(TestCase):
+
+    def test_matches_available_sections(self):
+        user = mommy.make(User)
+        sections = [
+            mommy.make(Section, field_name='s%s' % count, user=user)
+            for count in range(3)]
+        mommy.make(Section, field_name='other', user=mommy.make(User))
+        baseccos = mommy.make(BaseCCO, user=user, _quantity=4)
+        mommy.make(ChoiceSection, basecco=baseccos[0], section=sections[0])
+        mommy.make(ChoiceSection, basecco=baseccos[0], section=sections[1])
+        mommy.make(ChoiceSection, basecco=baseccos[1], section=sections[2])
+        foreign = mommy.make(
+            Section, field_name='foreign', user=mommy.make(User))
+        mommy.make(ChoiceSection, basecco=baseccos[2], section=foreign)
+        unowned = mommy.make(BaseCCO)
+        free = mommy.make(Section, field_name='free')
+        with self.assertNumQueries(2):
+            matrix = BaseCCO.objects.filter(
+                id__in=[basecco.id for basecco in baseccos + [unowned]]
+            ).section_matrix()
+            rows = matrix.rows
+        for basecco in baseccos + [unowned]:
+            self.assertEqual(
+                matrix.available[basecco.id],
+                set(basecco.available_sections().values_list(
+                    'id', flat=True)))
+        self.assertEqual(
+            matrix.attached[baseccos[0].id],
+            set([sections[0].id, sections[1].id]))
+        self.assertEqual(rows[0]['available'], [sections[2]])
+        self.assertEqual(rows[2]['attached'], [foreign])
+        self.assertEqual(rows[-1]['available'], [free])
+
+    def test_empty(self):
+        with self.assertNumQueries(1):
+            matrix = BaseCCO.objects.filter(id=0).section_matrix()
+        self.assertEqual(matrix.rows, [])
@@ -0,0 +1,13 @@
+from django.conf.urls import url
+
+from combinedchoices import views
+
+
+urlpatterns = [
+    url(r'^choices/search/$', views.choice_search,
+        name='combinedchoices-search'),
+    url(r'^ready/(?P<ready_id>\d+)/choices/$', views.choice_page,
+        name='combinedchoices-choices'),
+    url(r'^ready/(?P<ready_id>\d+)/schema/$', views.ready_schema,
+        name='combinedchoices-schema'),
+]
@@ -0,0 +1,110 @@
+from django.contrib.auth.decorators import login_required
+from django.core.urlresolvers import reverse
+from django.http import (
+    Http404, HttpResponse, HttpResponseNotModified, JsonResponse)
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+import json
+
+from combinedchoices.forms import ReadyForm
+from combinedchoices.models import ReadyCCO, Section
+from combinedchoices.schema import definitions_version, get_cache, page_choices
+from combinedchoices.search import search_choices
+from combinedchoices.snapshots import schema_hash
+
+
+LAYOUT_KEY = 'combinedchoices:layout:%s:%s:%s'
+
+
+@login_required
+def choice_page(request, ready_id, form_class=ReadyForm):
+    ready_obj = ReadyCCO.objects.get_or_404(id=ready_id, user=request.user)
+    field = request.GET.get('field')
+    entries = [
+        entry for entry in form_class.load_schema(ready_obj)
+        if entry['name'] == field and
+        entry['field_type'] in [Section.SINGLE, Section.MULTIPLE]]
+    if not entries:
+        raise Http404('Unknown field')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    choices, has_next = page_choices(
+        entries[0], query=request.GET.get('q', ''), page=page)
+    return JsonResponse({
+        'field': field, 'page': page, 'has_next': has_next,
+        'results': [{'id': pk, 'text': text} for pk, text in choices]})
+
+
+def int_param(request, name, default=None):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return default
+
+
+@login_required
+def choice_search(request):
+    page = max(int_param(request, 'page', 1), 1)
+    choices, has_next = search_choices(
+        request.GET.get('q', ''), user=request.user,
+        basecco=int_param(request, 'basecco'),
+        section=int_param(request, 'section'), page=page)
+    return JsonResponse({
+        'page': page, 'has_next': has_next,
+        'results': [
+            {'id': choice.pk, 'text': choice.text,
+             'choice_section': choice.choice_section_id}
+            for choice in choices]})
+
+
+def layout_entry(entry, choices_url):
+    data = dict((key, entry[key]) for key in (
+        'name', 'label', 'field_type', 'help_text', 'min_selects',
+        'max_selects', 'initial', 'lazy'))
+    if entry['lazy'] and entry['field_type'] in [
+            Section.SINGLE, Section.MULTIPLE]:
+        data['choices'] = []
+        data['choices_url'] = choices_url
+    else:
+        data['choices'] = entry['choices']
+    return data
+
+
+def ready_layout(ready_obj, form_class=ReadyForm):
+    """
+    Returns (etag, body) for the JSON layout of ready_obj, cached until
+    any definition changes.
+    """
+    cache = get_cache()
+    key = LAYOUT_KEY % (
+        form_class.__name__, ready_obj.pk, definitions_version())
+    layout = cache.get(key)
+    if layout is None:
+        choices_url = reverse('combinedchoices-choices', args=[ready_obj.pk])
+        data = {
+            'id': ready_obj.pk, 'form_name': ready_obj.form_name,
+            'fields': [
+                layout_entry(entry, choices_url)
+                for entry in form_class.load_schema(ready_obj)]}
+        layout = (schema_hash(data), json.dumps(
+            data, sort_keys=True, separators=(',', ':')))
+        cache.set(key, layout, None)
+    return layout
+
+
+@login_required
+def ready_schema(request, ready_id, form_class=ReadyForm):
+    ready_obj = ReadyCCO.objects.get_or_404(id=ready_id, user=request.user)
+    etag, body = ready_layout(ready_obj, form_class=form_class)
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (
+            etag in parse_etags(if_none_match) or if_none_match == '*'):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    patch_vary_headers(response, ['Cookie'])
+    return response